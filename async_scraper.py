@@ -0,0 +1,492 @@
+import asyncio
+import heapq
+import json
+import os
+import time
+from urllib.parse import urlparse
+from http_session import get_session, USER_AGENT, VIDEO_HEADERS, DEFAULT_TIMEOUT
+from rate_limit import get_adaptive_limiter
+from events import (log, emit, observable, propagate, PAGE_FETCHED, LISTING_FAILED, POST_SKIPPED, DOWNLOAD_STARTED,
+                    DOWNLOAD_FINISHED, DOWNLOAD_FAILED, SCRAPE_FINISHED)
+from metrics import count
+from posts import decode_listing
+from scrape_state import IncrementalScrape, post_id
+from listing import MAX_ATTEMPTS as LISTING_ATTEMPTS
+from downloader import (CHUNK_SIZE, DEFAULT_RETRIES, RETRY_BACKOFF, DownloadTooLarge, IncompleteDownload,
+                        PartialDownload, progress_events)
+from dedup_store import DIGEST_NAME, get_dedup_store, reuse_known, record_download
+from reddit_image_scraper import image_items
+from reddit_video_scraper import find_video_url
+from third_party_gif import find_redgif_url, resolve_gif_urls, gif_filename, REDGIFS_BATCH_SIZE
+
+# Connections shared by every scrape running on the session, in total and per host
+MAX_CONNECTIONS = 100
+MAX_CONNECTIONS_PER_HOST = 8
+# Statuses worth another try, same as the sync session's retry policy
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def create_async_session(timeout=DEFAULT_TIMEOUT, limit=MAX_CONNECTIONS, limit_per_host=MAX_CONNECTIONS_PER_HOST):
+    # aiohttp is only needed by this engine and is slow to import, so it is
+    # loaded on first use; the GUI and the sync scrapers run without it
+    try:
+        import aiohttp
+    except ImportError:
+        raise RuntimeError("The async engine needs aiohttp (pip install aiohttp)")
+    connect, read = timeout
+    return aiohttp.ClientSession(
+        headers={'User-Agent': USER_AGENT},
+        connector=aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host),
+        timeout=aiohttp.ClientTimeout(sock_connect=connect, sock_read=read),
+    )
+
+
+async def fetch_json(session, url, params=None, retries=LISTING_ATTEMPTS, limiter=None, loads=json.loads):
+    # GET returning the body decoded with `loads`, or None when the server keeps refusing.
+    # Requests are paced by the host's adaptive limiter, shared with the
+    # threaded listings, and throttled answers are retried after its backoff.
+    import aiohttp
+    limiter = limiter or get_adaptive_limiter(url)
+    for attempt in range(max(1, retries)):
+        await asyncio.sleep(limiter.reserve())
+        try:
+            async with session.get(url, params=params) as response:
+                limiter.update(response)
+                if response.status == 200:
+                    return await response.json(content_type=None, loads=loads)
+                if response.status not in RETRY_STATUSES or attempt + 1 >= max(1, retries):
+                    emit(LISTING_FAILED, f"Failed to fetch page: {response.status}", 'error', url=url,
+                         status=response.status)
+                    return None
+                delay = limiter.backoff(response, attempt)
+                log(f"Reddit answered {response.status}, retrying in {delay:.1f}s", level='warning')
+                count('listing_retries')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt + 1 >= max(1, retries):
+                emit(LISTING_FAILED, f"Error fetching {url}: {e}", 'error', url=url, error=str(e))
+                return None
+            delay = limiter.backoff(None, attempt)
+            log(f"Error fetching page ({e}), retrying in {delay:.1f}s", level='error')
+            count('listing_retries')
+    return None
+
+
+class AsyncListing:
+    # Async counterpart of ListingPrefetcher: the next page is requested as
+    # soon as the current one arrives, so it downloads while this one is
+    # being worked on. on_page gets the cursor that fetched each page.
+
+    def __init__(self, url, session, page_size=100, after=None, on_page=None, verbose=False):
+        self.url = url
+        self.session = session
+        self.page_size = page_size
+        self.start_after = after
+        self.after = after
+        self.on_page = on_page
+        self.verbose = verbose
+        self.failed = False
+
+    async def _fetch(self, after):
+        params = {'limit': self.page_size}
+        if after:
+            params['after'] = after
+        if self.verbose:
+            log(f"Fetching Reddit page: {self.url} with params {params}")
+        started = time.monotonic()
+        data = await fetch_json(self.session, self.url, params, loads=decode_listing)
+        if data is None:
+            self.failed = True
+            return [], None
+        data = data.get('data', {})
+        posts = [post.get('data', {}) for post in data.get('children', [])]
+        if posts:
+            emit(PAGE_FETCHED, url=self.url, cursor=after, posts=len(posts),
+                 seconds=round(time.monotonic() - started, 3))
+        return posts, data.get('after')
+
+    async def pages(self):
+        cursor = self.start_after
+        next_page = asyncio.ensure_future(self._fetch(cursor))
+        try:
+            while next_page:
+                posts, after = await next_page
+                next_page = None
+                if not posts:
+                    return
+                if after:
+                    next_page = asyncio.ensure_future(self._fetch(after))
+                if self.on_page:
+                    self.on_page(cursor)
+                yield posts
+                # Only advance once the consumer is done with the page
+                self.after = cursor = after
+        finally:
+            if next_page:
+                next_page.cancel()
+
+
+class AsyncDownloadPool:
+    # DownloadPool on an event loop: downloads are tasks instead of threads,
+    # with the same lowest-free-slot numbering and exact limit
+
+    def __init__(self, limit, concurrency=32, per_host_limit=MAX_CONNECTIONS_PER_HOST):
+        self.limit = limit
+        self.per_host_limit = max(1, per_host_limit)
+        self.completed = 0
+        self._concurrency = asyncio.Semaphore(max(1, concurrency))
+        self._free_slots = list(range(limit))
+        heapq.heapify(self._free_slots)
+        self._pending = {}
+        self._host_semaphores = {}
+
+    def full(self):
+        return self.completed + len(self._pending) >= self.limit
+
+    def remaining(self):
+        return len(self._free_slots)
+
+    def submit(self, url, fn, *args):
+        # fn is awaited as fn(slot, *args) and must return True on success
+        slot = heapq.heappop(self._free_slots)
+        task = asyncio.ensure_future(self._run(url, fn, slot, *args))
+        self._pending[task] = slot
+        return slot
+
+    async def wait_for_slot(self):
+        while self.full() and self._pending:
+            await self._reap(asyncio.FIRST_COMPLETED)
+        return self.completed < self.limit
+
+    async def drain(self):
+        while self._pending:
+            await self._reap(asyncio.ALL_COMPLETED)
+        return self.completed
+
+    def cancel(self):
+        for task in self._pending:
+            task.cancel()
+
+    def _host_semaphore(self, url):
+        host = urlparse(url).netloc.lower()
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.per_host_limit)
+        return self._host_semaphores[host]
+
+    async def _run(self, url, fn, slot, *args):
+        async with self._host_semaphore(url), self._concurrency:
+            try:
+                return bool(await fn(slot, *args))
+            except Exception as e:
+                log(f"Failed to download {url}: {e}", level='error')
+                return False
+
+    async def _reap(self, return_when):
+        done, _ = await asyncio.wait(list(self._pending), return_when=return_when)
+        for task in sorted(done, key=self._pending.get):
+            slot = self._pending.pop(task)
+            if not task.cancelled() and task.result():
+                self.completed += 1
+            else:
+                heapq.heappush(self._free_slots, slot)
+
+
+def _write_chunk(f, hasher, chunk):
+    f.write(chunk)
+    if hasher:
+        hasher.update(chunk)
+
+
+async def download_file_async(session, url, filepath, headers=None, max_bytes=None, retries=DEFAULT_RETRIES,
+                              chunk_size=CHUNK_SIZE, digest_name=None):
+    # Same contract, events and .part / .part.json layout as
+    # downloader.download_file, so either engine can resume what the other
+    # left behind. Disk writes and hashing run on the loop's executor to keep
+    # the loop free for sockets.
+    started = time.monotonic()
+    emit(DOWNLOAD_STARTED, url=url, path=filepath)
+    try:
+        result = await _download_attempts_async(session, url, filepath, headers, max_bytes, retries, chunk_size,
+                                                digest_name)
+    except Exception as e:
+        emit(DOWNLOAD_FAILED, url=url, path=filepath, error=str(e), seconds=round(time.monotonic() - started, 3))
+        raise
+    emit(DOWNLOAD_FINISHED, url=url, path=filepath, bytes=result[0] if digest_name else result,
+         seconds=round(time.monotonic() - started, 3))
+    return result
+
+
+async def _download_attempts_async(session, url, filepath, headers, max_bytes, retries, chunk_size, digest_name):
+    import aiohttp
+    progress = progress_events(url)
+    loop = asyncio.get_running_loop()
+    partial = PartialDownload(url, filepath, max_bytes)
+
+    for attempt in range(max(1, retries)):
+        request_headers = partial.headers(headers)
+        try:
+            async with session.get(url, headers=request_headers) as response:
+                # No urllib3 retries underneath, so throttled answers are retried here
+                offset, total = partial.accept(response.status, response, retry_statuses=RETRY_STATUSES)
+                hasher = None
+                if digest_name:
+                    hasher = await loop.run_in_executor(None, partial.hasher, digest_name)
+                downloaded = offset
+                f = await loop.run_in_executor(None, open, partial.part_path, 'ab' if offset else 'wb')
+                try:
+                    async for chunk in response.content.iter_chunked(chunk_size):
+                        downloaded += len(chunk)
+                        partial.check_size(downloaded)
+                        await loop.run_in_executor(None, _write_chunk, f, hasher, chunk)
+                        progress(downloaded, total)
+                finally:
+                    await loop.run_in_executor(None, f.close)
+                partial.check_complete(downloaded, total, response)
+
+            partial.finish()
+            if hasher:
+                return downloaded, hasher.hexdigest()
+            return downloaded
+
+        except DownloadTooLarge:
+            partial.discard()
+            raise
+        except (IncompleteDownload, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Keep the .part file; the next attempt picks up where this one stopped
+            if attempt + 1 >= max(1, retries):
+                raise
+            log(f"Download of {url} interrupted ({e}), retrying", level='warning')
+            count('download_retries')
+            await asyncio.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+
+async def fetch_deduplicated_async(store, url, filepath, session, post_ids=(), mode='link', **download_kwargs):
+    # dedup_store.fetch_deduplicated for the async engine; the index lookups
+    # are quick local SQLite reads and stay on the loop
+    known, saved = reuse_known(store, url, filepath, post_ids, mode)
+    if known:
+        return saved
+    size, digest = await download_file_async(session, url, filepath, digest_name=DIGEST_NAME, **download_kwargs)
+    return record_download(store, url, filepath, size, digest, post_ids, mode)
+
+
+async def _download_post(slot, media_url, kind, prefix, session, output_dir, base_index, state, post_data,
+                         max_bytes, dedup, dedup_store):
+    ext = os.path.splitext(urlparse(media_url).path)[1] or '.jpg'
+    index = base_index + slot
+    filename = f"{prefix}_{index}{ext}"
+    filepath = os.path.join(output_dir, filename)
+    if dedup:
+        saved = await fetch_deduplicated_async(dedup_store, media_url, filepath, session, mode=dedup,
+                                               max_bytes=max_bytes,
+                                               post_ids=(post_id(post_data), post_data.get('crosspost_parent')))
+        if not saved:
+            if state:
+                state.mark_seen(post_id(post_data), kind)
+            emit(POST_SKIPPED, post_id=post_id(post_data), reason='duplicate')
+            return False
+    else:
+        await download_file_async(session, media_url, filepath, max_bytes=max_bytes)
+    if state:
+        state.record(post_id(post_data), kind, index, filename)
+    log(f"Downloaded: {filename}")
+    return True
+
+
+async def _download_redgif(slot, video_url, session, output_dir, base_index, state, post_data, max_bytes):
+    index = base_index + slot
+    filename = gif_filename(post_data, index, os.path.splitext(urlparse(video_url).path)[1] or '.mp4')
+    headers = dict(VIDEO_HEADERS, Referer=post_data.get('url'))
+    try:
+        downloaded = await download_file_async(session, video_url, os.path.join(output_dir, filename), headers,
+                                               max_bytes=max_bytes)
+    except DownloadTooLarge as e:
+        log(f"Skipping {video_url}: {e}", level='warning')
+        return False
+    if state:
+        state.record(post_id(post_data), 'redgif', index, filename)
+    log(f"Downloaded: {filename} ({downloaded} bytes)")
+    return True
+
+
+class _session_scope:
+    # Uses the caller's session or opens (and later closes) a private one
+    def __init__(self, session):
+        self.session = session
+        self.owned = session is None
+
+    async def __aenter__(self):
+        if self.owned:
+            self.session = create_async_session()
+        return self.session
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.owned:
+            await self.session.close()
+
+
+async def _scrape_async(subreddit_name, sort_type, output_dir, limit, kind, prefix, find_items, label, concurrency,
+                        per_host_limit, incremental, max_bytes, dedup, dedup_store, session):
+    # find_items(post_data) -> [(item_post_data, url)]; gallery items each
+    # take a download slot of their own
+    if limit <= 0:
+        emit(SCRAPE_FINISHED, f"Total {label} downloaded: 0", subreddit=subreddit_name, media=f"{kind}s", count=0)
+        return 0
+    url = f"https://www.reddit.com/r/{subreddit_name}/{sort_type}.json"
+    os.makedirs(output_dir, exist_ok=True)
+    if dedup:
+        dedup_store = dedup_store or get_dedup_store()
+
+    run = IncrementalScrape(output_dir, subreddit_name, sort_type, incremental)
+    state = run.state
+    base_index = run.next_index(kind)
+
+    async with _session_scope(session) as session:
+        pool = AsyncDownloadPool(limit, concurrency, per_host_limit)
+        listing = AsyncListing(url, session, after=run.resume_after, on_page=run.save_cursor)
+        try:
+            async for posts in listing.pages():
+                reached_known = False
+                for post_data in posts:
+                    items = find_items(post_data)
+                    if not items:
+                        continue
+                    new_items = [(item, item_url) for item, item_url in items if run.is_new(item, kind)]
+                    if not new_items:
+                        emit(POST_SKIPPED, post_id=post_id(post_data), reason='seen')
+                        if run.stop_at_known():
+                            reached_known = True
+                            break
+                        continue
+                    for item, media_url in new_items:
+                        pool.submit(media_url, _download_post, media_url, kind, prefix, session, output_dir,
+                                    base_index, state, item, max_bytes, dedup, dedup_store)
+                        if not await pool.wait_for_slot():
+                            break
+                    if pool.completed >= pool.limit:
+                        break
+                if reached_known or not await pool.wait_for_slot():
+                    break
+            downloaded = await pool.drain()
+        finally:
+            pool.cancel()
+
+    run.finish(listing.failed)
+    emit(SCRAPE_FINISHED, f"Total {label} downloaded: {downloaded}", subreddit=subreddit_name,
+         media=f"{kind}s", count=downloaded)
+    return downloaded
+
+
+def _video_items(post_data):
+    video_url = find_video_url(post_data)
+    return [(post_data, video_url)] if video_url else []
+
+
+@observable
+async def scrape_subreddit_images_async(subreddit_name, sort_type="hot", output_dir="reddit_images", limit=50,
+                                        concurrency=32, per_host_limit=MAX_CONNECTIONS_PER_HOST, incremental=True,
+                                        max_bytes=None, dedup='link', dedup_store=None, session=None):
+    return await _scrape_async(subreddit_name, sort_type, output_dir, limit, 'image', 'image', image_items,
+                               'images', concurrency, per_host_limit, incremental, max_bytes, dedup, dedup_store,
+                               session)
+
+
+@observable
+async def scrape_subreddit_videos_async(subreddit_name, sort_type="new", output_dir="reddit_videos", limit=50,
+                                        concurrency=32, per_host_limit=MAX_CONNECTIONS_PER_HOST, incremental=True,
+                                        max_bytes=None, dedup='link', dedup_store=None, session=None):
+    return await _scrape_async(subreddit_name, sort_type, output_dir, limit, 'video', 'video', _video_items,
+                               'videos/gifs', concurrency, per_host_limit, incremental, max_bytes, dedup, dedup_store,
+                               session)
+
+
+@observable
+async def scrape_gif_videos_async(subreddit_name, sort_type="hot", output_dir="redgif_videos", limit=50,
+                                  concurrency=32, per_host_limit=MAX_CONNECTIONS_PER_HOST, batch_size=REDGIFS_BATCH_SIZE,
+                                  cache=None, incremental=True, max_bytes=None, session=None):
+    # Redgifs ids are resolved with the sync resolver (token handling, cache,
+    # HTML and CDN fallbacks) on the loop's executor, one call per batch;
+    # the videos themselves download on the loop
+    if limit <= 0:
+        emit(SCRAPE_FINISHED, "Total Redgif videos downloaded: 0", subreddit=subreddit_name, media='gifs', count=0)
+        return 0
+    url = f"https://www.reddit.com/r/{subreddit_name}/{sort_type}.json"
+    loop = asyncio.get_running_loop()
+    sync_session = get_session()
+    os.makedirs(output_dir, exist_ok=True)
+
+    run = IncrementalScrape(output_dir, subreddit_name, sort_type, incremental)
+    state = run.state
+    base_index = run.next_index('redgif')
+
+    async with _session_scope(session) as session:
+        pool = AsyncDownloadPool(limit, concurrency, per_host_limit)
+        listing = AsyncListing(url, session, page_size=500, after=run.resume_after, on_page=run.save_cursor,
+                               verbose=True)
+        try:
+            async for posts in listing.pages():
+                candidates = []
+                reached_known = False
+                for post_data in posts:
+                    redgif_url = find_redgif_url(post_data)
+                    if not redgif_url:
+                        continue
+                    if not run.is_new(post_data, 'redgif'):
+                        emit(POST_SKIPPED, post_id=post_id(post_data), reason='seen')
+                        if run.stop_at_known():
+                            reached_known = True
+                            break
+                        continue
+                    candidates.append((post_data, redgif_url))
+
+                while candidates and await pool.wait_for_slot():
+                    batch = candidates[:min(batch_size, pool.remaining())]
+                    candidates = candidates[len(batch):]
+                    resolved = await loop.run_in_executor(
+                        None, propagate(resolve_gif_urls), [redgif_url for _, redgif_url in batch], sync_session, batch_size, 4,
+                        cache)
+                    for post_data, redgif_url in batch:
+                        video_url = resolved.get(redgif_url)
+                        if not video_url:
+                            emit(POST_SKIPPED, "Failed to extract Redgif video URL", 'error',
+                                 post_id=post_id(post_data), reason='unresolved')
+                            continue
+                        if not await pool.wait_for_slot():
+                            break
+                        pool.submit(video_url, _download_redgif, video_url, session, output_dir, base_index, state,
+                                    post_data, max_bytes)
+
+                if reached_known or not await pool.wait_for_slot():
+                    break
+            downloaded = await pool.drain()
+        finally:
+            pool.cancel()
+
+    run.finish(listing.failed)
+    emit(SCRAPE_FINISHED, f"Total Redgif videos downloaded: {downloaded}", subreddit=subreddit_name,
+         media='gifs', count=downloaded)
+    return downloaded
+
+
+@observable
+async def scrape_subreddits_async(subreddit_names, scraper=scrape_subreddit_images_async, output_dir="reddit_downloads",
+                                  session=None, **kwargs):
+    # Runs one scraper over many subreddits concurrently on a single session,
+    # each into output_dir/<subreddit>. Returns {subreddit: count}, with None
+    # for a subreddit whose scrape raised.
+    async with _session_scope(session) as session:
+        results = await asyncio.gather(
+            *(scraper(name, output_dir=os.path.join(output_dir, name), session=session, **kwargs)
+              for name in subreddit_names),
+            return_exceptions=True)
+    counts = {}
+    for name, result in zip(subreddit_names, results):
+        if isinstance(result, BaseException):
+            log(f"Scrape of r/{name} failed: {result}", level='error')
+            result = None
+        counts[name] = result
+    return counts
+
+
+def scrape_subreddits(subreddit_names, scraper=scrape_subreddit_images_async, output_dir="reddit_downloads", **kwargs):
+    # Blocking entry point for callers without an event loop of their own
+    return asyncio.run(scrape_subreddits_async(subreddit_names, scraper, output_dir, **kwargs))
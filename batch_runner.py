@@ -0,0 +1,166 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from http_session import create_session
+from rate_limit import HostRateLimiter
+from reddit_image_scraper import scrape_subreddit_images
+from reddit_video_scraper import scrape_subreddit_videos
+from third_party_gif import scrape_gif_videos
+from media_scraper import scrape_subreddit_media
+from events import log, observable, propagate, tagged, collecting, LISTING_FAILED
+
+# Media type -> (subfolder under the subreddit's folder, default sort), as in the GUI
+MEDIA_TYPES = {
+    'images': ('images', 'hot'),
+    'videos': ('videos', 'new'),
+    'gifs': ('redgif_videos', 'hot'),
+    'all': ('', 'hot'),
+}
+
+
+def parse_job(entry):
+    # A job is {"subreddit": ..., "media": "images", "sort": ..., "limit": 50,
+    # "max_width": ..., "max_height": ..., "audio": true} with everything but
+    # the subreddit optional; a bare string is a subreddit
+    if isinstance(entry, str):
+        entry = {'subreddit': entry}
+    subreddit = (entry.get('subreddit') or '').strip()
+    if subreddit.lower().startswith('r/'):
+        subreddit = subreddit[2:]
+    if not subreddit:
+        raise ValueError(f"Job without a subreddit: {entry}")
+    media = entry.get('media', 'images')
+    if media not in MEDIA_TYPES:
+        raise ValueError(f"Unknown media type {media!r} for r/{subreddit}")
+    limit = int(entry.get('limit', 50))
+    if limit <= 0:
+        raise ValueError(f"Limit must be positive for r/{subreddit}")
+    return {
+        'subreddit': subreddit,
+        'media': media,
+        'sort': entry.get('sort') or MEDIA_TYPES[media][1],
+        'limit': limit,
+        'output_dir': entry.get('output_dir'),
+        'max_width': entry.get('max_width'),
+        'max_height': entry.get('max_height'),
+        'audio': bool(entry.get('audio', True)),
+    }
+
+
+def load_jobs(path):
+    # The job file is a JSON list of jobs, or {"jobs": [...], "rate_limits": {...}}
+    # where rate_limits maps a host to [requests per second, burst]
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {'jobs': data}
+    jobs = [parse_job(entry) for entry in data.get('jobs', [])]
+    rate_limits = {host: tuple(rate) for host, rate in data.get('rate_limits', {}).items()} or None
+    return jobs, rate_limits
+
+
+def job_base_dir(job, output_dir):
+    return job['output_dir'] or os.path.join(output_dir, job['subreddit'])
+
+
+def job_folders(job, output_dir):
+    # The folders a job writes into; `all` fills the images, videos and
+    # redgif_videos subfolders the single-type jobs use
+    base_dir = job_base_dir(job, output_dir)
+    if job['media'] == 'all':
+        subfolders = [subfolder for subfolder, _ in MEDIA_TYPES.values() if subfolder]
+    else:
+        subfolders = [MEDIA_TYPES[job['media']][0]]
+    return [os.path.abspath(os.path.join(base_dir, subfolder)) for subfolder in subfolders]
+
+
+def run_job(job, output_dir, session, executor, max_workers, per_host_limit):
+    job_dir = os.path.join(job_base_dir(job, output_dir), MEDIA_TYPES[job['media']][0])
+    args = (job['subreddit'],)
+    kwargs = {'sort_type': job['sort'], 'output_dir': job_dir, 'session': session}
+    if job['media'] == 'images':
+        return scrape_subreddit_images(*args, limit=job['limit'], max_workers=max_workers,
+                                       per_host_limit=per_host_limit, executor=executor, max_width=job['max_width'],
+                                       max_height=job['max_height'], **kwargs)
+    if job['media'] == 'videos':
+        return scrape_subreddit_videos(*args, limit=job['limit'], max_height=job['max_height'], audio=job['audio'],
+                                       **kwargs)
+    if job['media'] == 'gifs':
+        return scrape_gif_videos(*args, limit=job['limit'], **kwargs)
+    limits = {media_type: job['limit'] for media_type in ('images', 'videos', 'gifs')}
+    return scrape_subreddit_media(*args, limits=limits, max_workers=max_workers, per_host_limit=per_host_limit,
+                                  executor=executor, max_width=job['max_width'], max_height=job['max_height'],
+                                  audio=job['audio'], **kwargs)
+
+
+@observable
+def run_jobs(jobs, output_dir="reddit_downloads", max_jobs=4, download_workers=16, per_host_limit=4,
+             rate_limits=None, session=None):
+    # Runs the jobs `max_jobs` at a time. Image downloads from every job share
+    # one pool of `download_workers` threads, and all requests go through one
+    # session whose per-host token buckets keep the whole batch under the
+    # rate limits. Returns one result dict per job, in job order. Events
+    # carry the subreddit and media type of the job they came from. Jobs that
+    # write into the same folder (the same subreddit with another sort, or
+    # `all` next to a single type) run one after the other: they share the
+    # folder's state and file numbering. A job whose listing broke off is
+    # 'partial' when it still downloaded something, else 'failed'.
+    session = session or create_session(rate_limiter=HostRateLimiter(rate_limits))
+    results = [None] * len(jobs)
+    folder_locks = {folder: threading.Lock() for job in jobs for folder in job_folders(job, output_dir)}
+
+    with ThreadPoolExecutor(max_workers=max(1, download_workers)) as downloads, \
+            ThreadPoolExecutor(max_workers=max(1, max_jobs)) as runner:
+        def run(i, job):
+            result = dict(job, status='ok', count=None, error=None)
+            with tagged(subreddit=job['subreddit'], media=job['media']), \
+                    collecting(LISTING_FAILED) as listing_failures, ExitStack() as folders:
+                # Always taken in sorted order so two jobs can't wait on each other
+                for folder in sorted(job_folders(job, output_dir)):
+                    folders.enter_context(folder_locks[folder])
+                started = time.monotonic()
+                try:
+                    result['count'] = run_job(job, output_dir, session, downloads, download_workers, per_host_limit)
+                except Exception as e:
+                    log(f"Job r/{job['subreddit']} ({job['media']}) failed: {e}", level='error')
+                    result.update(status='failed', error=str(e))
+                else:
+                    # The scrapers don't raise when the listing breaks off, they report it
+                    if listing_failures.events:
+                        count = result['count']
+                        downloaded = sum(count.values()) if isinstance(count, dict) else count
+                        result.update(status='partial' if downloaded else 'failed',
+                                      error=listing_failures.events[-1].message)
+            result['seconds'] = round(time.monotonic() - started, 2)
+            results[i] = result
+
+        for future in [runner.submit(propagate(run), i, job) for i, job in enumerate(jobs)]:
+            future.result()
+    return results
+
+
+def print_summary(results):
+    for result in results:
+        count = result['count']
+        if isinstance(count, dict):
+            count = ", ".join(f"{media_type} {n}" for media_type, n in count.items())
+        if result['status'] == 'partial':
+            outcome = f"{count}, listing broke off: {result['error']}"
+        elif result['status'] == 'failed':
+            outcome = f"failed: {result['error']}"
+        else:
+            outcome = count
+        log(f"r/{result['subreddit']} {result['media']} ({result['sort']}): {outcome} in {result['seconds']}s")
+    failed = sum(1 for result in results if result['status'] == 'failed')
+    partial = sum(1 for result in results if result['status'] == 'partial')
+    log(f"{len(results) - failed - partial} of {len(results)} jobs finished, {partial} partly, {failed} failed")
+
+
+if __name__ == "__main__":
+    # Same options, output and exit codes as `cli.py batch`
+    from cli import main
+    sys.exit(main(['batch', *sys.argv[1:]]))
@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+from collections import Counter
+from urllib.parse import urlparse
+
+# Times how fast posts are routed to a scraper (media_scraper.classify_post)
+# on a large synthetic listing with a realistic mix of hosts, against the
+# per-scraper regex checks it replaced, and shows where the two disagree.
+# Nothing touches the network.
+#
+#   python benchmarks/classify.py --posts 200000 --runs 5
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Share of each kind of post in the listing
+MIX = {
+    'reddit_image': 30,
+    'reddit_image_query': 5,
+    'preview_only': 3,
+    'gallery': 8,
+    'reddit_video': 15,
+    'imgur_image': 6,
+    'imgur_gifv': 4,
+    'external_image': 4,
+    'external_gif': 2,
+    'redgifs': 10,
+    'redgifs_thumbs': 2,
+    'gifdeliverynetwork': 1,
+    'selftext_redgifs': 2,
+    'link': 5,
+    'self': 3,
+}
+
+
+def make_post(n, kind):
+    post_id = f"p{n}"
+    data = {
+        'id': post_id,
+        'name': f"t3_{post_id}",
+        'title': f"Post {n}",
+        'permalink': f"/r/bench/comments/{post_id}/post_{n}/",
+        'url': f"https://www.reddit.com/r/bench/comments/{post_id}/post_{n}/",
+        'selftext': '',
+        'score': n % 5000,
+        'num_comments': n % 300,
+        'author': f"user{n % 977}",
+    }
+    preview = {'images': [{
+        'source': {'url': f"https://preview.redd.it/{post_id}.jpg?auto=webp&amp;s=x{n}", 'width': 1920,
+                   'height': 1080},
+        'resolutions': [{'url': f"https://preview.redd.it/{post_id}.jpg?width={w}&amp;crop=smart&amp;s=x{n}",
+                         'width': w, 'height': w * 9 // 16} for w in (108, 216, 320, 640, 960, 1080)],
+    }]}
+    if kind == 'reddit_image':
+        data.update(post_hint='image', url=f"https://i.redd.it/{post_id}.jpg", preview=preview)
+    elif kind == 'reddit_image_query':
+        data.update(post_hint='image', url=f"https://i.redd.it/{post_id}.png?s={n}", preview=preview)
+    elif kind == 'preview_only':
+        data.update(url=f"https://www.reddit.com/r/bench/comments/{post_id}/", preview=preview)
+    elif kind == 'gallery':
+        media_ids = [f"g{n}x{item}" for item in range(3)]
+        data.update(is_gallery=True, url=f"https://www.reddit.com/gallery/{post_id}",
+                    gallery_data={'items': [{'media_id': media_id, 'id': item}
+                                            for item, media_id in enumerate(media_ids)]},
+                    media_metadata={media_id: {'status': 'valid', 'e': 'Image', 'm': 'image/jpg',
+                                               's': {'u': f"https://preview.redd.it/{media_id}.jpg?s=x",
+                                                     'x': 2048, 'y': 1536}} for media_id in media_ids})
+    elif kind == 'reddit_video':
+        data.update(is_video=True, post_hint='hosted:video', url=f"https://v.redd.it/{post_id}", preview=preview,
+                    media={'reddit_video': {'fallback_url': f"https://v.redd.it/{post_id}/DASH_720.mp4?source=fallback",
+                                            'dash_url': f"https://v.redd.it/{post_id}/DASHPlaylist.mpd",
+                                            'height': 720, 'width': 1280, 'has_audio': True}})
+    elif kind == 'imgur_image':
+        data.update(post_hint='image', url=f"https://i.imgur.com/{post_id}.jpg", preview=preview)
+    elif kind == 'imgur_gifv':
+        data.update(post_hint='link', url=f"https://i.imgur.com/{post_id}.gifv", preview=preview)
+    elif kind == 'external_image':
+        data.update(post_hint='image', url=f"https://cdn.example.com/media/{post_id}.webp?w=1200", preview=preview)
+    elif kind == 'external_gif':
+        data.update(url=f"https://media.example.org/{post_id}.gif")
+    elif kind == 'redgifs':
+        data.update(post_hint='rich:video', url=f"https://www.redgifs.com/watch/gif{n}", preview=preview)
+    elif kind == 'redgifs_thumbs':
+        data.update(url=f"https://thumbs2.redgifs.com/Gif{n}-mobile.mp4")
+    elif kind == 'gifdeliverynetwork':
+        data.update(url=f"https://www.gifdeliverynetwork.com/gif{n}")
+    elif kind == 'selftext_redgifs':
+        data.update(is_self=True, selftext=f"Source: https://redgifs.com/watch/gif{n} enjoy")
+    elif kind == 'link':
+        data.update(post_hint='link', url=f"https://news.example.com/article/{n}", preview=preview)
+    else:
+        data.update(is_self=True, selftext=f"Just text in post {n}. " * 20)
+    return {'kind': 't3', 'data': data}
+
+
+def make_listing(posts, seed):
+    rng = random.Random(seed)
+    kinds = rng.choices(list(MIX), weights=list(MIX.values()), k=posts)
+    return json.dumps({'kind': 'Listing', 'data': {'children': [make_post(n, kind) for n, kind in enumerate(kinds)]}})
+
+
+# The checks each scraper ran before url_classifier.py, for comparison
+
+def legacy_image_url(post_data):
+    img_url = None
+    if post_data.get('post_hint') == 'image' and 'url' in post_data:
+        img_url = post_data['url']
+    elif 'preview' in post_data and 'images' in post_data['preview']:
+        img_url = post_data['preview']['images'][0]['source']['url'].replace('&amp;', '&')
+    if img_url and re.search(r'\.(jpg|jpeg|png|webp)$', img_url, re.IGNORECASE):
+        return img_url
+    return None
+
+
+def legacy_video_url(post_data):
+    video_url = None
+    if post_data.get('is_video') and 'media' in post_data and post_data['media'] and 'reddit_video' in post_data['media']:
+        video_url = post_data['media']['reddit_video'].get('fallback_url')
+    elif 'url' in post_data and re.search(r'\.(gif|mp4|webm)$', post_data['url'], re.IGNORECASE):
+        video_url = post_data['url']
+    if video_url and re.search(r'\.(mp4|webm|gif)$', video_url, re.IGNORECASE):
+        return video_url
+    return None
+
+
+def legacy_redgif_url(post_data):
+    post_url = post_data.get('url')
+    if not post_url:
+        return None
+    if "redgifs.com" in post_url or "gifdeliverynetwork.com" in post_url:
+        return post_url
+    if post_data.get('selftext'):
+        match = re.search(r'https?://(?:www\.)?redgifs\.com/\S+', post_data['selftext'])
+        if match:
+            return match.group(0)
+    return None
+
+
+def legacy_gif_id(url):
+    if "redgifs.com" in url or "gifdeliverynetwork.com" in url:
+        match = re.search(r'/watch/([^/]+)$|/([^/]+)$|/ifr/([^/]+)$', urlparse(url).path)
+        if match:
+            return match.group(1) or match.group(2) or match.group(3)
+    return None
+
+
+def legacy_url_checks(url):
+    # What the scrapers asked of one URL between them
+    return (bool(re.search(r'\.(jpg|jpeg|png|webp)$', url, re.IGNORECASE)),
+            bool(re.search(r'\.(gif|mp4|webm)$', url, re.IGNORECASE)),
+            legacy_gif_id(url))
+
+
+def legacy_classify(post_data):
+    # media_scraper.classify_post as it was, with the same gallery and
+    # preview handling as today so only the URL checks differ
+    from reddit_image_scraper import image_items
+    from variants import preview_variant
+    if post_data.get('is_gallery'):
+        if image_items(post_data):
+            return 'images'
+    if legacy_video_url(post_data):
+        return 'videos'
+    redgif_url = legacy_redgif_url(post_data)
+    if redgif_url:
+        legacy_gif_id(redgif_url)
+        return 'gifs'
+    if legacy_image_url(post_data):
+        preview_variant(post_data)
+        return 'images'
+    return None
+
+
+def classify(post_data):
+    from media_scraper import classify_post
+    from third_party_gif import extract_gif_id
+    media_type, items = classify_post(post_data)
+    if media_type == 'gifs':
+        extract_gif_id(items[0][1])
+    return media_type
+
+
+def time_routing(route, items, runs, before_run=None):
+    # Median seconds for one pass over items, and the result for each
+    timings = []
+    routes = None
+    for _ in range(runs):
+        if before_run:
+            before_run()
+        started = time.perf_counter()
+        routes = [route(item) for item in items]
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), routes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark post routing on a synthetic listing")
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="FILE", help="also write the results to FILE")
+    options = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    from posts import decode_listing
+    from url_classifier import classify_url
+    children = decode_listing(make_listing(options.posts, options.seed))['data']['children']
+    posts = [child['data'] for child in children]
+    # Import the scrapers outside the timed passes
+    classify(posts[0])
+    legacy_classify(posts[0])
+
+    # The classifier's cache is emptied before every pass so repeated passes
+    # over the same URLs don't flatter it
+    urls = [post_data.get('url') for post_data in posts]
+    legacy_url_seconds, _ = time_routing(legacy_url_checks, urls, options.runs)
+    url_seconds, _ = time_routing(classify_url, urls, options.runs, before_run=classify_url.cache_clear)
+    legacy_seconds, legacy_routes = time_routing(legacy_classify, posts, options.runs)
+    seconds, routes = time_routing(classify, posts, options.runs, before_run=classify_url.cache_clear)
+    # Posts the classifier routes differently do different work afterwards
+    # (a video download instead of nothing), so compare on the rest too
+    same = [post_data for post_data, before, after in zip(posts, legacy_routes, routes) if before == after]
+    legacy_same_seconds, _ = time_routing(legacy_classify, same, options.runs)
+    same_seconds, _ = time_routing(classify, same, options.runs, before_run=classify_url.cache_clear)
+
+    results = {
+        'posts': len(posts),
+        'legacy_url_seconds': legacy_url_seconds,
+        'url_seconds': url_seconds,
+        'legacy_seconds': legacy_seconds,
+        'legacy_posts_per_second': len(posts) / legacy_seconds,
+        'seconds': seconds,
+        'posts_per_second': len(posts) / seconds,
+        'unchanged_posts': len(same),
+        'legacy_unchanged_seconds': legacy_same_seconds,
+        'unchanged_seconds': same_seconds,
+        'legacy_routes': dict(Counter(str(route) for route in legacy_routes)),
+        'routes': dict(Counter(str(route) for route in routes)),
+        'changed': dict(Counter(f"{before} -> {after}" for before, after in zip(legacy_routes, routes)
+                                if before != after)),
+    }
+    print(f"{len(posts)} posts, median of {options.runs} runs")
+    print(f"{'':16} {'post URLs':>12} {'routing':>12} {'posts/s':>10} {'unchanged':>12}")
+    print(f"{'regex checks':16} {legacy_url_seconds * 1000:9.1f} ms {legacy_seconds * 1000:9.1f} ms "
+          f"{results['legacy_posts_per_second']:10.0f} {legacy_same_seconds * 1000:9.1f} ms")
+    print(f"{'url_classifier':16} {url_seconds * 1000:9.1f} ms {seconds * 1000:9.1f} ms "
+          f"{results['posts_per_second']:10.0f} {same_seconds * 1000:9.1f} ms")
+    print("Routing (before, after):")
+    for route in sorted(set(results['legacy_routes']) | set(results['routes'])):
+        print(f"  {route:<8} {results['legacy_routes'].get(route, 0):>8} {results['routes'].get(route, 0):>8}")
+    if results['changed']:
+        print("Changed:")
+        for change, changed in sorted(results['changed'].items()):
+            print(f"  {change:<18} {changed:>8}")
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
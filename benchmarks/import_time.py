@@ -0,0 +1,63 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+# Measures how long each entry point takes to import, in a fresh interpreter
+# per run so nothing is cached between them. `main` is the GUI and is skipped
+# where customtkinter isn't installed.
+#
+#   python benchmarks/import_time.py --runs 10
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    'cli',
+    'main',
+    'reddit_image_scraper',
+    'reddit_video_scraper',
+    'third_party_gif',
+    'media_scraper',
+    'batch_runner',
+    'async_scraper',
+]
+
+# Modules that should never be loaded just by importing the entry point
+HEAVY_MODULES = ['requests', 'aiohttp', 'PIL', 'customtkinter']
+
+
+def measure(module):
+    # Returns (microseconds spent importing `module`, heavy modules it loaded),
+    # or None when the module can't be imported here
+    code = f"import sys; import {module}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=REPO_DIR,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        parts = line.split('|')
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]), [name for name in result.stdout.strip().split(',') if name]
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark import time of the screddit entry points")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    options = parser.parse_args()
+
+    print(f"{'module':<24}{'median ms':>10}{'min ms':>10}  loads")
+    for module in options.modules:
+        samples = [measure(module) for _ in range(options.runs)]
+        if any(sample is None for sample in samples):
+            print(f"{module:<24}{'skipped (not importable here)':>30}")
+            continue
+        times = [sample[0] / 1000 for sample in samples]
+        print(f"{module:<24}{statistics.median(times):>10.1f}{min(times):>10.1f}  {', '.join(samples[0][1]) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-in for reddit.com, i.redd.it / v.redd.it and Redgifs (site,
+# API and thumbs CDN), so the scrapers can be exercised without a network.
+# Every https URL is served under the mock's base URL with the host as the
+# first path segment: https://i.redd.it/x.jpg -> http://127.0.0.1:port/i.redd.it/x.jpg.
+# rewriting_session() gives the scrapers a session that does that mapping.
+#
+# The listing is synthetic and deterministic for a seed: `pages` pages of
+# posts whose kinds are drawn from `mix`. Media bodies are unique per URL
+# so the dedup index doesn't collapse them.
+
+# Relative weight of each post kind in the listing
+DEFAULT_MIX = {'image': 4, 'gallery': 1, 'video': 2, 'redgif': 3, 'text': 1}
+REDGIFS_TOKEN = "mock-token"
+
+
+class MockReddit:
+    def __init__(self, pages=5, page_size=100, mix=None, latency=0.0, media_bytes=64 * 1024,
+                 throttle_every=0, fail_every=0, api_miss_every=0, seed=1):
+        # latency: seconds added to every response
+        # throttle_every: every Nth listing request is answered 429
+        # fail_every: every Nth media item always answers 500
+        # api_miss_every: every Nth Redgifs id is unknown to the API, which
+        #   sends the scraper to the watch page and the CDN probes
+        self.pages = pages
+        self.page_size = page_size
+        self.latency = latency
+        self.media_bytes = media_bytes
+        self.throttle_every = throttle_every
+        self.fail_every = fail_every
+        self.api_miss_every = api_miss_every
+        self.kinds = self._draw_kinds(mix or DEFAULT_MIX, pages * page_size, seed)
+        self.stats = {'listing': 0, 'throttled': 0, 'media': 0, 'media_bytes': 0, 'failed': 0,
+                      'redgifs_api': 0, 'redgifs_page': 0, 'redgifs_probe': 0}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @staticmethod
+    def _draw_kinds(mix, total, seed):
+        rng = random.Random(seed)
+        kinds, weights = zip(*mix.items())
+        return rng.choices(kinds, weights, k=total)
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.stats[name] += value
+
+    def start(self, port=0):
+        # Serves on a background thread; returns the base URL
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), _Handler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def expected_media(self):
+        # Posts of each kind in the whole listing
+        return {kind: self.kinds.count(kind) for kind in set(self.kinds)}
+
+    def post(self, n):
+        kind = self.kinds[n]
+        post_id = f"p{n}"
+        data = {
+            'id': post_id,
+            'name': f"t3_{post_id}",
+            'title': f"Post {n}",
+            'permalink': f"/r/mock/comments/{post_id}/post_{n}/",
+            'selftext': '',
+            'score': 1000 - n % 1000,
+            'url': f"https://www.reddit.com/r/mock/comments/{post_id}/post_{n}/",
+        }
+        if kind == 'image':
+            width, height = 3840, 2160
+            data.update(post_hint='image', url=f"https://i.redd.it/{post_id}.jpg", preview={'images': [{
+                'source': {'url': f"https://i.redd.it/{post_id}.jpg", 'width': width, 'height': height},
+                'resolutions': [
+                    {'url': f"https://preview.redd.it/{post_id}.jpg?width={w}&amp;crop=smart&amp;auto=webp&amp;s=x{n}",
+                     'width': w, 'height': w * height // width}
+                    for w in (108, 216, 320, 640, 960, 1080)
+                ],
+            }]})
+        elif kind == 'gallery':
+            media_ids = [f"g{n}x{item}" for item in range(2 + n % 4)]
+            data.update(is_gallery=True, url=f"https://www.reddit.com/gallery/{post_id}", gallery_data={'items': [
+                {'media_id': media_id, 'id': item} for item, media_id in enumerate(media_ids)
+            ]}, media_metadata={media_id: {
+                'status': 'valid', 'e': 'Image', 'm': 'image/jpg',
+                's': {'u': f"https://preview.redd.it/{media_id}.jpg?width=2048&amp;format=pjpg&amp;auto=webp&amp;s=x{n}",
+                      'x': 2048, 'y': 1536},
+                'p': [{'u': f"https://preview.redd.it/{media_id}.jpg?width={w}&amp;crop=smart&amp;auto=webp&amp;s=x{n}",
+                       'x': w, 'y': w * 3 // 4} for w in (108, 216, 320, 640, 960, 1080)],
+            } for media_id in media_ids})
+        elif kind == 'video':
+            data.update(is_video=True, url=f"https://v.redd.it/{post_id}", media={'reddit_video': {
+                'fallback_url': f"https://v.redd.it/{post_id}/DASH_720.mp4",
+                'dash_url': f"https://v.redd.it/{post_id}/DASHPlaylist.mpd",
+                'height': 720,
+                'width': 1280,
+                'bitrate_kbps': 2400,
+                'duration': 30,
+                'is_gif': False,
+                'has_audio': True,
+            }})
+        elif kind == 'redgif':
+            data.update(url=f"https://www.redgifs.com/watch/{gif_id(n)}")
+        else:
+            data.update(is_self=True, selftext=f"Just text in post {n}. " * 20)
+        return {'kind': 't3', 'data': data}
+
+    def listing(self, after, limit):
+        start = int(after[len('t3_p'):]) + 1 if after else 0
+        end = min(start + min(limit, self.page_size), len(self.kinds))
+        children = [self.post(n) for n in range(start, end)]
+        return {'kind': 'Listing', 'data': {
+            'after': f"t3_p{end - 1}" if end < len(self.kinds) and children else None,
+            'dist': len(children),
+            'children': children,
+        }}
+
+    def is_failing(self, n):
+        return bool(self.fail_every) and n % self.fail_every == self.fail_every - 1
+
+    def api_knows(self, n):
+        return not (self.api_miss_every and n % self.api_miss_every == self.api_miss_every - 1)
+
+
+def manifest(video_path):
+    # DASH manifest of a 720p clip as v.redd.it serves it: one file per
+    # representation, named relative to the manifest
+    videos = ''.join(
+        f'<Representation id="{height}" mimeType="video/mp4" bandwidth="{height * 3000}" width="{height * 16 // 9}" '
+        f'height="{height}"><BaseURL>DASH_{height}.mp4</BaseURL></Representation>'
+        for height in (720, 480, 360, 240))
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" mediaPresentationDuration="PT30S"><Period>'
+            f'<AdaptationSet contentType="video">{videos}</AdaptationSet>'
+            '<AdaptationSet contentType="audio"><Representation id="5" mimeType="audio/mp4" bandwidth="130000">'
+            '<BaseURL>DASH_AUDIO_128.mp4</BaseURL></Representation></AdaptationSet>'
+            '</Period></MPD>')
+
+
+def gif_id(n):
+    return f"MockGif{n}"
+
+
+def gif_number(video_id):
+    # The post number in an id or file name: MockGif7.mp4 -> 7, g5x2.jpg -> 5
+    match = re.search(r'\d+', video_id)
+    return int(match.group(0)) if match else -1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without this the client's
+    # delayed ACK adds ~40ms to every small response
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def send(self, status, body=b'', content_type='application/octet-stream', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def send_json(self, data, headers=None):
+        self.send(200, json.dumps(data).encode(), 'application/json', headers)
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        if self.mock.latency:
+            time.sleep(self.mock.latency)
+        url = urlparse(self.path)
+        host, _, path = url.path.lstrip('/').partition('/')
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        route = ROUTES.get(host)
+        if not route:
+            return self.send(404)
+        route(self, '/' + path, query)
+
+    def reddit(self, path, query):
+        if not path.endswith('.json'):
+            return self.send(404)
+        with self.mock._lock:
+            self.mock.stats['listing'] += 1
+            throttled = self.mock.throttle_every and self.mock.stats['listing'] % self.mock.throttle_every == 0
+        if throttled:
+            self.mock.count('throttled')
+            return self.send(429, b'{"error": 429}', 'application/json', {'Retry-After': '0'})
+        data = self.mock.listing(query.get('after'), int(query.get('limit', 25)))
+        self.send_json(data, {
+            'X-Ratelimit-Remaining': '600.0',
+            'X-Ratelimit-Used': str(self.mock.stats['listing']),
+            'X-Ratelimit-Reset': '600',
+        })
+
+    def media(self, path, query):
+        # /p12.jpg, /p12/DASH_720.mp4, /MockGif12.mp4; byte ranges are honoured
+        n = gif_number(path.split('/')[1] if path.count('/') > 1 else path)
+        if self.mock.is_failing(n):
+            self.mock.count('failed')
+            return self.send(500)
+        if path.endswith('/DASHPlaylist.mpd'):
+            return self.send(200, manifest(path.rsplit('/', 1)[0]).encode(), 'application/dash+xml')
+        body = path.encode().ljust(self.mock.media_bytes, b'.')
+        if path.rsplit('/', 1)[-1].startswith('DASH_AUDIO'):
+            body = body[:len(body) // 8]
+        headers = {'ETag': f'"{n}"', 'Accept-Ranges': 'bytes'}
+        status = 200
+        ranged = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if ranged:
+            start = int(ranged.group(1))
+            end = min(int(ranged.group(2) or len(body) - 1), len(body) - 1)
+            headers['Content-Range'] = f"bytes {start}-{end}/{len(body)}"
+            status, body = 206, body[start:end + 1]
+        if self.command == 'GET':
+            self.mock.count('media')
+            self.mock.count('media_bytes', len(body))
+        content_type = 'video/mp4' if path.endswith('.mp4') else 'image/jpeg'
+        self.send(status, body, content_type, headers)
+
+    def redgifs_site(self, path, query):
+        if path == '/':
+            return self.send(200, f'<script>window.__auth={{accessToken:"{REDGIFS_TOKEN}"}}</script>'.encode(),
+                             'text/html')
+        if path.startswith('/watch/'):
+            self.mock.count('redgifs_page')
+            n = gif_number(path)
+            # Every other id the API doesn't know has its video on the page
+            if n % 2:
+                return self.send(404)
+            return self.send(200, f'<video><source src="https://thumbs2.redgifs.com/{gif_id(n)}.mp4" '
+                                  f'type="video/mp4"></video>'.encode(), 'text/html')
+        self.send(404)
+
+    def redgifs_api(self, path, query):
+        self.mock.count('redgifs_api')
+        if self.headers.get('Authorization') != f"Bearer {REDGIFS_TOKEN}":
+            return self.send(401)
+        if path == '/v2/gifs':
+            ids = [video_id for video_id in query.get('ids', '').split(',') if video_id]
+            return self.send_json({'gifs': [self.gif(video_id) for video_id in ids
+                                             if self.mock.api_knows(gif_number(video_id))]})
+        if path.startswith('/v2/gifs/'):
+            video_id = path.rsplit('/', 1)[1]
+            if not self.mock.api_knows(gif_number(video_id)):
+                return self.send(404)
+            return self.send_json({'gif': self.gif(video_id)})
+        self.send(404)
+
+    def gif(self, video_id):
+        n = gif_number(video_id)
+        return {'id': video_id.lower(), 'urls': {
+            'hd': f"https://thumbs2.redgifs.com/{gif_id(n)}.mp4",
+            'sd': f"https://thumbs2.redgifs.com/{gif_id(n)}-mobile.mp4",
+        }}
+
+    def redgifs_thumbs(self, path, query):
+        if self.command == 'HEAD':
+            self.mock.count('redgifs_probe')
+            # Probes only find videos on the first thumbs host
+            if not self.path.startswith('/thumbs.redgifs.com/'):
+                return self.send(404)
+        self.media(path, query)
+
+
+ROUTES = {
+    'www.reddit.com': _Handler.reddit,
+    'i.redd.it': _Handler.media,
+    'preview.redd.it': _Handler.media,
+    'v.redd.it': _Handler.media,
+    'www.redgifs.com': _Handler.redgifs_site,
+    'api.redgifs.com': _Handler.redgifs_api,
+}
+ROUTES.update({f"thumbs{suffix}.redgifs.com": _Handler.redgifs_thumbs for suffix in ('', '1', '2', '3', '4', '5')})
+
+
+def rewrite_url(url, base_url):
+    # https://host/path -> <base_url>/host/path
+    if url.startswith('https://'):
+        return f"{base_url}/{url[len('https://'):]}"
+    return url
+
+
+def rewriting_session(base_url, **kwargs):
+    # A regular scraper session whose requests all go to the mock
+    from http_session import create_session
+    session = create_session(**kwargs)
+    # Requests for a host keep going through that host's adapter (its pool
+    # size and which statuses it retries itself)
+    for prefix, adapter in list(session.adapters.items()):
+        if prefix.startswith('https://') and prefix != 'https://':
+            session.mount(rewrite_url(prefix, base_url), adapter)
+    request = session.request
+    def rewritten(method, url, *args, **request_kwargs):
+        return request(method, rewrite_url(url, base_url), *args, **request_kwargs)
+    session.request = rewritten
+    return session
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve a synthetic Reddit/Redgifs for manual testing")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0)
+    options = parser.parse_args()
+    mock = MockReddit(pages=options.pages, latency=options.latency)
+    print(f"Serving on {mock.start(options.port)}, e.g. {mock.base_url}/www.reddit.com/r/mock/hot.json")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        mock.stop()
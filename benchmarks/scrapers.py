@@ -0,0 +1,199 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Runs each scraper entry point against the local mock (mock_reddit.py) and
+# reports wall time, files and bytes saved, throughput, listing and download
+# latency and peak memory. Each run happens in a fresh interpreter with its
+# own empty data directory, so caches, the Redgifs token and peak RSS don't
+# carry over between runs.
+#
+#   python benchmarks/scrapers.py --pages 10 --latency 0.02 --runs 3
+#   python benchmarks/scrapers.py images gifs --throttle-every 7 --json results.json
+#
+# The async engine talks through aiohttp rather than the requests session the
+# mock hooks into, so it isn't covered here.
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+ENTRY_POINTS = ['images', 'videos', 'gifs', 'all', 'resolve']
+
+
+def run_entry_point(entry, session, output_dir, limit, workers):
+    # Returns the number of files saved (or URLs resolved)
+    if entry == 'images':
+        from reddit_image_scraper import scrape_subreddit_images
+        return scrape_subreddit_images('mock', output_dir=output_dir, limit=limit, max_workers=workers,
+                                       session=session)
+    if entry == 'videos':
+        from reddit_video_scraper import scrape_subreddit_videos
+        return scrape_subreddit_videos('mock', sort_type='hot', output_dir=output_dir, limit=limit, session=session)
+    if entry == 'gifs':
+        from third_party_gif import scrape_gif_videos
+        return scrape_gif_videos('mock', output_dir=output_dir, limit=limit, session=session)
+    if entry == 'all':
+        from media_scraper import scrape_subreddit_media
+        counts = scrape_subreddit_media('mock', output_dir=output_dir, max_workers=workers, session=session,
+                                        limits={'images': limit, 'videos': limit, 'gifs': limit})
+        return sum(counts.values())
+    if entry == 'resolve':
+        # extract_gif_url one post at a time, the way callers outside the scrapers use it
+        from listing import ListingPrefetcher
+        from third_party_gif import find_redgif_url, extract_gif_url
+        resolved = 0
+        with ListingPrefetcher("https://www.reddit.com/r/mock/hot.json", session, remaining=limit,
+                               is_candidate=lambda post_data: find_redgif_url(post_data) is not None) as listing:
+            for post_data in listing:
+                url = find_redgif_url(post_data)
+                if url and extract_gif_url(url, session, cache=False):
+                    resolved += 1
+                    listing.set_remaining(limit - resolved)
+                    if resolved >= limit:
+                        break
+        return resolved
+    raise ValueError(f"Unknown entry point {entry}")
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1048576 if sys.platform == 'darwin' else 1024), 1)
+
+
+def child(options):
+    # One measured run; prints its result as JSON on stdout
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCHMARK_DIR)
+    from mock_reddit import rewriting_session
+    from metrics import RunMetrics
+    from events import observing
+
+    session = rewriting_session(options.base_url)
+    metrics = RunMetrics()
+    started = time.monotonic()
+    with observing(metrics):
+        saved = run_entry_point(options.entry, session, options.output_dir, options.limit, options.workers)
+    seconds = time.monotonic() - started
+    print(json.dumps({'seconds': seconds, 'saved': saved, 'peak_rss_mb': peak_rss_mb(),
+                      'metrics': metrics.summary()}))
+
+
+def measure(entry, base_url, options):
+    with tempfile.TemporaryDirectory(prefix='screddit-bench-') as scratch:
+        env = dict(os.environ, SCREDDIT_DATA_DIR=os.path.join(scratch, 'data'))
+        command = [sys.executable, os.path.abspath(__file__), '--child', entry, '--base-url', base_url,
+                   '--output-dir', os.path.join(scratch, 'out'), '--limit', str(options.limit),
+                   '--workers', str(options.workers)]
+        result = subprocess.run(command, cwd=REPO_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{entry} failed:\n{result.stderr.strip()}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def stage(run, name, field):
+    stats = run['metrics']['stages'].get(name)
+    return stats[field] * 1000 if stats and stats[field] is not None else None
+
+
+def summarize(entry, runs, requests):
+    # Median over the runs of each figure
+    def median(values):
+        values = [value for value in values if value is not None]
+        return statistics.median(values) if values else None
+    downloaded = [run['metrics']['counters'].get('downloaded_bytes', 0) for run in runs]
+    return {
+        'entry': entry,
+        'runs': len(runs),
+        'seconds': median([run['seconds'] for run in runs]),
+        'saved': median([run['saved'] for run in runs]),
+        'mb': median(downloaded) / 1048576,
+        'mb_per_second': median([size / 1048576 / run['seconds'] for size, run in zip(downloaded, runs)]),
+        'listing_p50_ms': median([stage(run, 'listing_fetch', 'p50') for run in runs]),
+        'listing_p95_ms': median([stage(run, 'listing_fetch', 'p95') for run in runs]),
+        'download_p95_ms': median([stage(run, 'download', 'p95') for run in runs]),
+        'retries': median([run['metrics']['counters'].get('listing_retries', 0)
+                           + run['metrics']['counters'].get('download_retries', 0) for run in runs]),
+        'peak_rss_mb': median([run['peak_rss_mb'] for run in runs]),
+        'server_requests': requests / len(runs),
+    }
+
+
+def print_table(results):
+    columns = [('entry', '<10', '{}'), ('seconds', '>8', '{:.2f}'), ('saved', '>6', '{:.0f}'),
+               ('mb', '>7', '{:.1f}'), ('mb_per_second', '>8', '{:.1f}'), ('listing_p50_ms', '>8', '{:.0f}'),
+               ('listing_p95_ms', '>8', '{:.0f}'), ('download_p95_ms', '>9', '{:.0f}'), ('retries', '>8', '{:.0f}'),
+               ('peak_rss_mb', '>8', '{:.1f}'), ('server_requests', '>9', '{:.0f}')]
+    headers = ['entry', 'seconds', 'saved', 'MB', 'MB/s', 'list p50', 'list p95', 'dl p95 ms', 'retries',
+               'RSS MB', 'requests']
+    print(' '.join(f"{header:{align}}" for header, (_, align, _) in zip(headers, columns)))
+    for result in results:
+        cells = []
+        for name, align, fmt in columns:
+            value = result[name]
+            cells.append(f"{'-' if value is None else fmt.format(value):{align}}")
+        print(' '.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scrapers against a local mock Reddit/Redgifs")
+    parser.add_argument("entries", nargs="*", default=ENTRY_POINTS, help=f"any of {', '.join(ENTRY_POINTS)}")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=100, help="posts to download per entry point")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--media-kb", type=int, default=64, help="size of every media file")
+    parser.add_argument("--throttle-every", type=int, default=0, help="answer every Nth listing request with 429")
+    parser.add_argument("--fail-every", type=int, default=0, help="make every Nth media item fail")
+    parser.add_argument("--api-miss-every", type=int, default=0,
+                        help="hide every Nth Redgifs id from the API to exercise the fallbacks")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", metavar="FILE", help="also write the results to FILE")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--output-dir", help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child:
+        options.entry = options.child
+        return child(options)
+
+    unknown = [entry for entry in options.entries if entry not in ENTRY_POINTS]
+    if unknown:
+        parser.error(f"unknown entry points: {', '.join(unknown)}")
+
+    sys.path.insert(0, BENCHMARK_DIR)
+    from mock_reddit import MockReddit
+    mock = MockReddit(pages=options.pages, page_size=options.page_size, latency=options.latency,
+                      media_bytes=options.media_kb * 1024, throttle_every=options.throttle_every,
+                      fail_every=options.fail_every, api_miss_every=options.api_miss_every, seed=options.seed)
+    results = []
+    with mock:
+        for entry in options.entries:
+            before = sum(mock.stats[name] for name in ('listing', 'media', 'redgifs_api', 'redgifs_page',
+                                                        'redgifs_probe'))
+            runs = [measure(entry, mock.base_url, options) for _ in range(options.runs)]
+            after = sum(mock.stats[name] for name in ('listing', 'media', 'redgifs_api', 'redgifs_page',
+                                                       'redgifs_probe'))
+            results.append(summarize(entry, runs, after - before))
+    print_table(results)
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({'options': {name: value for name, value in vars(options).items()
+                                   if name not in ('child', 'base_url', 'output_dir', 'json', 'entry')},
+                       'results': results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
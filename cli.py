@@ -0,0 +1,221 @@
+import argparse
+import json
+import sys
+import threading
+from events import Event, observing, LOG, LISTING_FAILED
+from metrics import RunMetrics
+
+# Only the scrapers are imported (lazily, per command), never the GUI, so this
+# runs on machines without Tk, customtkinter or Pillow
+
+EXIT_OK = 0
+# A scrape raised or a listing broke off before it was done
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+# Batch runs where some jobs failed and others finished
+EXIT_PARTIAL = 3
+EXIT_INTERRUPTED = 130
+
+class EventWriter:
+    # Observer for the scrapers' events: writes each one as a JSON object per
+    # line when `json_lines` is set, otherwise just the messages (the lines
+    # the scrapers used to print). Called from download threads too, so
+    # writes are serialised.
+
+    def __init__(self, stream, json_lines=False):
+        self.stream = stream
+        self.json_lines = json_lines
+        self.listing_errors = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        if event.type == LISTING_FAILED:
+            self.listing_errors += 1
+        if self.json_lines:
+            line = json.dumps(event.to_dict())
+        elif event.message:
+            line = event.message
+        else:
+            return
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    def emit(self, event, **fields):
+        # The CLI's own start / finish events
+        if self.json_lines:
+            self(Event(event, **fields))
+
+
+def _dedup(value):
+    return None if value == 'off' else value
+
+
+def run_images(options):
+    from reddit_image_scraper import scrape_subreddit_images
+    return scrape_subreddit_images(options.subreddit, sort_type=options.sort or "hot",
+                                   output_dir=options.output_dir or "reddit_images", limit=options.limit,
+                                   max_workers=options.workers, per_host_limit=options.per_host,
+                                   incremental=options.incremental, max_bytes=options.max_bytes,
+                                   dedup=_dedup(options.dedup), max_width=options.max_width,
+                                   max_height=options.max_height)
+
+
+def run_videos(options):
+    from reddit_video_scraper import scrape_subreddit_videos
+    return scrape_subreddit_videos(options.subreddit, sort_type=options.sort or "new",
+                                   output_dir=options.output_dir or "reddit_videos", limit=options.limit,
+                                   incremental=options.incremental, max_bytes=options.max_bytes,
+                                   dedup=_dedup(options.dedup), max_height=options.max_height,
+                                   audio=options.audio)
+
+
+def run_gifs(options):
+    from third_party_gif import scrape_gif_videos
+    return scrape_gif_videos(options.subreddit, sort_type=options.sort or "hot",
+                             output_dir=options.output_dir or "redgif_videos", limit=options.limit,
+                             incremental=options.incremental, max_bytes=options.max_bytes)
+
+
+def run_all(options):
+    from media_scraper import scrape_subreddit_media
+    limits = {
+        'images': options.limit if options.images is None else options.images,
+        'videos': options.limit if options.videos is None else options.videos,
+        'gifs': options.limit if options.gifs is None else options.gifs,
+    }
+    return scrape_subreddit_media(options.subreddit, sort_type=options.sort or "hot",
+                                  output_dir=options.output_dir or "reddit_media", limits=limits,
+                                  max_workers=options.workers, per_host_limit=options.per_host,
+                                  incremental=options.incremental, max_bytes=options.max_bytes,
+                                  dedup=_dedup(options.dedup), max_width=options.max_width,
+                                  max_height=options.max_height, audio=options.audio)
+
+
+def run_batch(options):
+    from batch_runner import load_jobs, run_jobs, print_summary
+    jobs, rate_limits = load_jobs(options.job_file)
+    results = run_jobs(jobs, options.output_dir or "reddit_downloads", options.jobs, options.workers,
+                       options.per_host, rate_limits)
+    print_summary(results)
+    if options.results:
+        with open(options.results, 'w') as f:
+            json.dump(results, f, indent=2)
+    return results
+
+
+def report_metrics(writer, metrics, options):
+    # Run summary: a metrics event in JSON mode, a few plain lines otherwise
+    if options.json:
+        writer.emit('metrics', **metrics.summary())
+    else:
+        for line in metrics.report():
+            writer(Event(LOG, line))
+    if options.metrics:
+        try:
+            metrics.write(options.metrics)
+        except OSError as e:
+            print(f"Could not write metrics to {options.metrics}: {e}", file=sys.stderr)
+
+
+def _positive_int(value):
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="screddit", description="Download media from subreddits")
+    parser.add_argument("--json", action="store_true", help="write progress as JSON lines on stdout")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="write per-stage timings and counters to FILE (Prometheus text for .prom, else JSON)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    scrape = argparse.ArgumentParser(add_help=False)
+    scrape.add_argument("subreddit", help="subreddit name without r/")
+    scrape.add_argument("--sort", choices=["hot", "new", "top", "best", "rising"])
+    scrape.add_argument("--limit", type=_positive_int, default=50)
+    scrape.add_argument("--output-dir")
+    scrape.add_argument("--max-bytes", type=_positive_int, help="skip files larger than this")
+    scrape.add_argument("--no-incremental", dest="incremental", action="store_false",
+                        help="ignore what earlier runs downloaded")
+
+    pooled = argparse.ArgumentParser(add_help=False)
+    pooled.add_argument("--workers", type=_positive_int, default=8, help="concurrent downloads")
+    pooled.add_argument("--per-host", type=_positive_int, default=4, help="concurrent downloads per host")
+
+    dedup = argparse.ArgumentParser(add_help=False)
+    dedup.add_argument("--dedup", choices=["link", "skip", "off"], default="link",
+                       help="what to do with media already downloaded elsewhere")
+
+    # Smaller copies are picked from what the listing offers, without extra requests
+    height = argparse.ArgumentParser(add_help=False)
+    height.add_argument("--max-height", type=_positive_int,
+                        help="largest image height in pixels; for Reddit videos the rendition, e.g. 480")
+    audio = argparse.ArgumentParser(add_help=False)
+    audio.add_argument("--no-audio", dest="audio", action="store_false",
+                       help="save Reddit videos without their sound track (one request less per video)")
+    width = argparse.ArgumentParser(add_help=False)
+    width.add_argument("--max-width", type=_positive_int, help="largest image width in pixels")
+
+    images = commands.add_parser("images", parents=[scrape, pooled, dedup, width, height], help="download images")
+    images.set_defaults(run=run_images)
+    videos = commands.add_parser("videos", parents=[scrape, dedup, height, audio],
+                                 help="download Reddit videos and gifs")
+    videos.set_defaults(run=run_videos)
+    gifs = commands.add_parser("gifs", parents=[scrape], help="download Redgifs videos")
+    gifs.set_defaults(run=run_gifs)
+    media = commands.add_parser("all", parents=[scrape, pooled, dedup, width, height, audio],
+                                help="download every media type in one pass")
+    for media_type in ("images", "videos", "gifs"):
+        media.add_argument(f"--{media_type}", type=int, help=f"limit for {media_type} (default: --limit)")
+    media.set_defaults(run=run_all)
+
+    # Not the `pooled` parent: set_defaults on a parent's action changes it for
+    # every subcommand that uses it
+    batch = commands.add_parser("batch", help="run the jobs in a job file")
+    batch.add_argument("job_file")
+    batch.add_argument("--workers", type=_positive_int, default=16, help="download threads shared by all jobs")
+    batch.add_argument("--per-host", type=_positive_int, default=4, help="concurrent downloads per host and job")
+    batch.add_argument("--output-dir")
+    batch.add_argument("--jobs", type=_positive_int, default=4, help="subreddits scraped at the same time")
+    batch.add_argument("--results", help="write the per-job results to this JSON file")
+    batch.set_defaults(run=run_batch)
+    return parser
+
+
+def main(argv=None):
+    options = build_parser().parse_args(argv)
+    writer = EventWriter(sys.stdout, options.json)
+    metrics = RunMetrics(forward=writer)
+    writer.emit('start', command=options.command, subreddit=getattr(options, 'subreddit', None))
+    try:
+        with observing(metrics):
+            result = options.run(options)
+    except KeyboardInterrupt:
+        report_metrics(writer, metrics, options)
+        writer.emit('finish', status='interrupted')
+        return EXIT_INTERRUPTED
+    except Exception as e:
+        report_metrics(writer, metrics, options)
+        writer.emit('finish', status='failed', error=str(e))
+        if not options.json:
+            print(f"Error: {e}", file=sys.stderr)
+        return EXIT_FAILED
+
+    report_metrics(writer, metrics, options)
+
+    if options.command == 'batch':
+        failed = sum(1 for job in result if job['status'] != 'ok')
+        writer.emit('finish', status='ok' if not failed else 'partial', jobs=len(result), failed=failed)
+        if failed:
+            return EXIT_FAILED if failed == len(result) else EXIT_PARTIAL
+        return EXIT_OK
+    status = 'failed' if writer.listing_errors else 'ok'
+    writer.emit('finish', status=status, downloaded=result)
+    return EXIT_FAILED if writer.listing_errors else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
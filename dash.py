@@ -0,0 +1,143 @@
+import os
+import shutil
+import subprocess
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+from http_session import get_session
+from downloader import download_file_parallel, DownloadError
+from events import log, propagate
+from metrics import timed, count
+
+# v.redd.it keeps video and audio in separate DASH streams; the fallback_url
+# the listing gives is the video alone. This fetches the manifest, picks a
+# video and an audio representation, downloads both at once (each as
+# parallel byte ranges when large) and muxes them with ffmpeg when it is on
+# the PATH. Without ffmpeg the audio is kept next to the video as
+# `<name>.audio.m4a`.
+
+MPD_NAMESPACE = {'mpd': 'urn:mpeg:dash:schema:mpd:2011'}
+AUDIO_SUFFIX = '.audio.m4a'
+# Seconds ffmpeg gets to remux one clip
+MUX_TIMEOUT = 300
+
+
+class ManifestError(Exception):
+    pass
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_manifest(text, manifest_url):
+    # Returns {'video': [...], 'audio': [...]}, each a list of
+    # {'url', 'bandwidth', 'width', 'height'}. Only single-file representations
+    # (a BaseURL each, as v.redd.it serves them) are understood.
+    try:
+        root = ElementTree.fromstring(text)
+    except ElementTree.ParseError as e:
+        raise ManifestError(f"Unreadable manifest {manifest_url}: {e}")
+    streams = {'video': [], 'audio': []}
+    for adaptation in root.iterfind('.//mpd:AdaptationSet', MPD_NAMESPACE):
+        for representation in adaptation.iterfind('mpd:Representation', MPD_NAMESPACE):
+            mime_type = representation.get('mimeType') or adaptation.get('mimeType') or ''
+            content_type = adaptation.get('contentType') or mime_type.split('/')[0]
+            base_url = representation.findtext('mpd:BaseURL', namespaces=MPD_NAMESPACE)
+            if content_type not in streams or not base_url:
+                continue
+            streams[content_type].append({
+                'url': urljoin(manifest_url, base_url.strip()),
+                'bandwidth': _int(representation.get('bandwidth')),
+                'width': _int(representation.get('width')),
+                'height': _int(representation.get('height')),
+            })
+    if not streams['video']:
+        raise ManifestError(f"No video representation in {manifest_url}")
+    return streams
+
+
+def pick_representations(streams, max_height=None):
+    # The best video no taller than max_height (the smallest when none is)
+    # and the best audio; renditions are compared on their short side, as
+    # v.redd.it names them
+    def rendition(video):
+        return min(video['width'], video['height']) or video['height']
+    videos = streams['video']
+    fitting = [video for video in videos if not max_height or rendition(video) <= max_height]
+    if fitting:
+        video = max(fitting, key=lambda video: (rendition(video), video['bandwidth']))
+    else:
+        video = min(videos, key=lambda video: (rendition(video), video['bandwidth']))
+    audio = max(streams['audio'], key=lambda audio: audio['bandwidth']) if streams['audio'] else None
+    return video, audio
+
+
+@timed('dash_manifest')
+def fetch_manifest(manifest_url, session):
+    response = session.get(manifest_url)
+    if response.status_code != 200:
+        raise DownloadError(f"HTTP {response.status_code} for {manifest_url}")
+    return parse_manifest(response.content, response.url)
+
+
+def ffmpeg_path():
+    return shutil.which('ffmpeg')
+
+
+@timed('mux')
+def mux(video_path, audio_path, filepath, ffmpeg):
+    # Stream copy, no re-encode; returns False when ffmpeg refused
+    command = [ffmpeg, '-y', '-loglevel', 'error', '-i', video_path, '-i', audio_path,
+               '-map', '0:v:0', '-map', '1:a:0', '-c', 'copy', '-movflags', '+faststart', filepath]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=MUX_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        log(f"ffmpeg failed on {os.path.basename(filepath)}: {e}", level='warning')
+        return False
+    if result.returncode != 0:
+        log(f"ffmpeg failed on {os.path.basename(filepath)}: {result.stderr.strip()[:200]}", level='warning')
+        return False
+    return True
+
+
+def download_dash_video(manifest_url, filepath, session=None, max_height=None, max_bytes=None, ffmpeg=None):
+    # Saves the clip with its audio to filepath. Returns the audio sidecar's
+    # path when it couldn't be muxed in, otherwise None. ffmpeg=None looks it
+    # up on the PATH, ffmpeg=False never muxes.
+    session = session or get_session()
+    video, audio = pick_representations(fetch_manifest(manifest_url, session), max_height)
+    if not audio:
+        # Clips without sound have no audio stream at all
+        download_file_parallel(video['url'], filepath, session, max_bytes=max_bytes)
+        return None
+
+    ffmpeg = ffmpeg_path() if ffmpeg is None else ffmpeg
+    base = os.path.splitext(filepath)[0]
+    video_path = f"{base}.video.mp4" if ffmpeg else filepath
+    audio_path = base + AUDIO_SUFFIX
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(propagate(download_file_parallel), stream['url'], path, session,
+                                       max_bytes=max_bytes)
+                       for stream, path in ((video, video_path), (audio, audio_path))]
+            for future in futures:
+                future.result()
+    except Exception:
+        # Don't leave half a clip behind; the caller falls back to the video alone
+        for path in (video_path, audio_path):
+            if path != filepath and os.path.exists(path):
+                os.remove(path)
+        raise
+
+    if ffmpeg and mux(video_path, audio_path, filepath, ffmpeg):
+        os.remove(video_path)
+        os.remove(audio_path)
+        return None
+    if video_path != filepath:
+        os.replace(video_path, filepath)
+    count('dash_audio_sidecars')
+    return audio_path
@@ -0,0 +1,188 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+from sqlite_store import SQLiteStore, data_dir
+from downloader import download_file, CHUNK_SIZE
+from events import log
+from metrics import count
+
+DIGEST_NAME = 'sha256'
+
+# What to do with a file whose content is already on disk elsewhere:
+# "link" hard-links it into place (counted as a download), "skip" leaves it out
+DEDUP_MODES = ('link', 'skip')
+
+
+class DedupStore(SQLiteStore):
+    # Content-addressed index shared by every subreddit and run: maps content
+    # digests to the first file saved with that content, and source URLs and
+    # Reddit post ids to digests so known media can be matched before any
+    # bytes are fetched
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS contents (
+            digest TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            added_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS urls (
+            url TEXT PRIMARY KEY,
+            digest TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS posts (
+            post_id TEXT PRIMARY KEY,
+            digest TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path=None):
+        super().__init__(path or os.path.join(data_dir(), "content_index.sqlite3"))
+
+    def _existing_path(self, digest):
+        row = self._conn.execute("SELECT path FROM contents WHERE digest = ?", (digest,)).fetchone()
+        if row and os.path.exists(row[0]):
+            return row[0]
+        return None
+
+    def find_by_digest(self, digest):
+        with self._lock:
+            return self._existing_path(digest)
+
+    def find_by_source(self, url=None, post_ids=()):
+        # Returns (digest, path) of known content for a URL or any of the post ids
+        with self._lock:
+            rows = []
+            if url:
+                rows.append(self._conn.execute("SELECT digest FROM urls WHERE url = ?", (url,)).fetchone())
+            for post_id in post_ids:
+                if post_id:
+                    rows.append(self._conn.execute("SELECT digest FROM posts WHERE post_id = ?", (post_id,)).fetchone())
+            for row in rows:
+                if row:
+                    path = self._existing_path(row[0])
+                    if path:
+                        return row[0], path
+        return None, None
+
+    def add(self, digest, path, size, url=None, post_ids=()):
+        with self._lock, self._conn:
+            # Keep the first copy as canonical unless it has since been deleted
+            if not self._existing_path(digest):
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO contents (digest, path, size, added_at) VALUES (?, ?, ?, ?)",
+                    (digest, os.path.abspath(path), size, time.time()))
+            if url:
+                self._conn.execute("INSERT OR REPLACE INTO urls (url, digest) VALUES (?, ?)", (url, digest))
+            for post_id in post_ids:
+                if post_id:
+                    self._conn.execute("INSERT OR REPLACE INTO posts (post_id, digest) VALUES (?, ?)", (post_id, digest))
+
+
+def link_or_copy(source, target):
+    if os.path.abspath(source) == os.path.abspath(target):
+        return
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        # Different filesystem or no hard link support: still saves the download
+        shutil.copy2(source, target)
+
+
+def file_digest(path):
+    # (size, hexdigest) of a file already on disk
+    hasher = hashlib.new(DIGEST_NAME)
+    size = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+            size += len(chunk)
+    return size, hasher.hexdigest()
+
+
+def source_keys(url, post_ids, rendition=None):
+    # A post id (or a DASH manifest) stands for every size of the media, so a
+    # downscaled rendition ('512x', see variants.rendition_key) is indexed
+    # under its own keys and never matches the original
+    post_ids = [post_id for post_id in post_ids if post_id]
+    if not rendition:
+        return url, post_ids
+    return f"{url}#{rendition}", [f"{post_id}#{rendition}" for post_id in post_ids]
+
+
+def reuse_known(store, url, filepath, post_ids=(), mode='link', sidecars=(), rendition=None):
+    # The step before a download: when the URL or one of the posts is already
+    # in the index, links the known file to filepath (or leaves it out in
+    # "skip" mode) and returns (True, filepath or None). (False, None) means
+    # the media has to be fetched. Files next to the known one whose names end
+    # in one of `sidecars` (e.g. a separate audio track) are linked along.
+    url, post_ids = source_keys(url, post_ids, rendition)
+    digest, existing = store.find_by_source(url, post_ids)
+    if not existing:
+        return False, None
+    count('dedup_source_hits')
+    store.add(digest, existing, os.path.getsize(existing), url, post_ids)
+    if mode == 'skip':
+        log(f"Skipped duplicate of {os.path.basename(existing)}: {url}")
+        return True, None
+    link_or_copy(existing, filepath)
+    for suffix in sidecars:
+        sidecar = os.path.splitext(existing)[0] + suffix
+        if os.path.exists(sidecar):
+            link_or_copy(sidecar, os.path.splitext(filepath)[0] + suffix)
+    log(f"Linked duplicate of {os.path.basename(existing)}: {url}")
+    return True, filepath
+
+
+def record_download(store, url, filepath, size, digest, post_ids=(), mode='link', rendition=None):
+    # The step after a download: indexes it, and when the same content was
+    # already on disk replaces it with a link (or removes it in "skip" mode).
+    # Returns the path written, or None when the duplicate was dropped.
+    url, post_ids = source_keys(url, post_ids, rendition)
+    existing = store.find_by_digest(digest)
+    store.add(digest, existing or filepath, size, url, post_ids)
+    if existing and os.path.abspath(existing) != os.path.abspath(filepath):
+        count('dedup_content_hits')
+        if mode == 'skip':
+            os.remove(filepath)
+            log(f"Skipped duplicate of {os.path.basename(existing)}: {url}")
+            return None
+        link_or_copy(existing, filepath)
+        log(f"Replaced duplicate with a link to {os.path.basename(existing)}")
+    return filepath
+
+
+def fetch_deduplicated(store, url, filepath, session=None, post_ids=(), mode='link', download=None, sidecars=(),
+                       rendition=None, **download_kwargs):
+    # Downloads url to filepath unless the same media is already on disk.
+    # Returns the path written, or None when a duplicate was skipped.
+    # post_ids should hold the post's own id and its crosspost_parent, so a
+    # crosspost of something already fetched never touches the network.
+    # `download(filepath)` replaces the plain download for files that take
+    # more than one request to build (e.g. a muxed video); it returns
+    # (size, digest) like download_file with digest_name. See reuse_known for
+    # `sidecars` and source_keys for `rendition`.
+    known, saved = reuse_known(store, url, filepath, post_ids, mode, sidecars, rendition)
+    if known:
+        return saved
+    if download:
+        size, digest = download(filepath)
+    else:
+        size, digest = download_file(url, filepath, session, digest_name=DIGEST_NAME, **download_kwargs)
+    return record_download(store, url, filepath, size, digest, post_ids, mode, rendition)
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_dedup_store():
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = DedupStore()
+        return _default_store
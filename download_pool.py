@@ -0,0 +1,85 @@
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+from urllib.parse import urlparse
+from events import log, propagate
+
+
+class DownloadPool:
+    # Every download gets the lowest free slot in range(limit); a failed download
+    # hands its slot back for the next candidate, so filenames stay deterministic
+    # and no more than `limit` downloads ever succeed. Pools can share one
+    # `executor` to cap the number of download threads across several scrapes.
+
+    def __init__(self, limit, max_workers=8, per_host_limit=4, executor=None):
+        self.limit = limit
+        self.per_host_limit = max(1, per_host_limit)
+        self.completed = 0
+        self._owns_executor = executor is None
+        self._executor = executor or ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self._free_slots = list(range(limit))
+        heapq.heapify(self._free_slots)
+        self._pending = {}
+        self._host_semaphores = {}
+        self._host_lock = threading.Lock()
+
+    def full(self):
+        return self.completed + len(self._pending) >= self.limit
+
+    def remaining(self):
+        return len(self._free_slots)
+
+    def submit(self, url, fn, *args):
+        # fn is called as fn(slot, *args) and must return True on success
+        slot = heapq.heappop(self._free_slots)
+        # The download runs in the submitting scrape's context so its events reach the right observer
+        future = self._executor.submit(propagate(self._run), url, fn, slot, *args)
+        self._pending[future] = slot
+        return slot
+
+    def wait_for_slot(self):
+        while self.full() and self._pending:
+            self._reap(FIRST_COMPLETED)
+        return self.completed < self.limit
+
+    def drain(self):
+        while self._pending:
+            self._reap(ALL_COMPLETED)
+        return self.completed
+
+    def shutdown(self):
+        if self._owns_executor:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.drain()
+        self.shutdown()
+
+    def _host_semaphore(self, url):
+        host = urlparse(url).netloc.lower()
+        with self._host_lock:
+            semaphore = self._host_semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host_limit)
+                self._host_semaphores[host] = semaphore
+            return semaphore
+
+    def _run(self, url, fn, slot, *args):
+        with self._host_semaphore(url):
+            try:
+                return bool(fn(slot, *args))
+            except Exception as e:
+                log(f"Failed to download {url}: {e}", level='error')
+                return False
+
+    def _reap(self, return_when):
+        done, _ = wait(list(self._pending), return_when=return_when)
+        for future in sorted(done, key=self._pending.get):
+            slot = self._pending.pop(future)
+            if future.result():
+                self.completed += 1
+            else:
+                heapq.heappush(self._free_slots, slot)
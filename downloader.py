@@ -0,0 +1,351 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from http_session import get_session
+from events import log, emit, propagate, DOWNLOAD_STARTED, DOWNLOAD_PROGRESS, DOWNLOAD_FINISHED, DOWNLOAD_FAILED
+from metrics import count
+
+# Bytes read from the socket and written to disk per iteration; also the most an
+# interrupted attempt can lose before it resumes
+CHUNK_SIZE = 256 * 1024
+# Attempts per file; each attempt after the first resumes from the .part file
+DEFAULT_RETRIES = 3
+RETRY_BACKOFF = 1.0
+# Seconds between download_progress events for one file
+PROGRESS_INTERVAL = 0.5
+# download_file_parallel splits files of at least PARALLEL_MIN_SIZE bytes into
+# this many concurrent range requests
+PARALLEL_PARTS = 4
+PARALLEL_MIN_SIZE = 8 * 1024 * 1024
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DownloadTooLarge(DownloadError):
+    pass
+
+
+class IncompleteDownload(DownloadError):
+    pass
+
+
+def open_stream(url, session=None, headers=None, **kwargs):
+    session = session or get_session()
+    response = session.get(url, headers=headers, stream=True, **kwargs)
+    if response.status_code not in (200, 206):
+        response.close()
+        raise DownloadError(f"HTTP {response.status_code} for {url}")
+    return response
+
+
+def content_length(response):
+    try:
+        return int(response.headers.get('Content-Length', 0))
+    except ValueError:
+        return 0
+
+
+def content_range(response):
+    # "bytes 100-199/1000" -> (100, 1000); the total may be "*"
+    match = re.match(r'bytes (\d+)-\d+/(\d+|\*)', response.headers.get('Content-Range', ''))
+    if not match:
+        return None, None
+    total = int(match.group(2)) if match.group(2) != '*' else None
+    return int(match.group(1)), total
+
+
+class PartialDownload:
+    # The resume bookkeeping of one download, shared by download_file and the
+    # async engine so only their I/O differs. Partial data is kept in
+    # `<filepath>.part` next to a small `.part.json` holding the validators
+    # (ETag / Last-Modified) and the expected size. Per attempt: headers()
+    # gives the request headers (Range + If-Range when there is data to
+    # resume), accept() checks the response and returns the offset to write
+    # from and the expected total, and finish() moves the file into place.
+    # `response` is anything with a `headers` mapping; the status is passed
+    # separately since requests and aiohttp name it differently.
+
+    def __init__(self, url, filepath, max_bytes=None):
+        self.url = url
+        self.filepath = filepath
+        self.max_bytes = max_bytes
+        self.part_path = filepath + '.part'
+        self.meta_path = self.part_path + '.json'
+        # Signed CDN URLs change their query string between runs, so match on the path
+        self.url_path = urlparse(url).path
+        self.offset = 0
+        self.meta = {}
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def discard(self):
+        for path in (self.part_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def headers(self, headers=None):
+        self.meta = self._read_meta()
+        self.offset = os.path.getsize(self.part_path) if os.path.exists(self.part_path) else 0
+        if self.offset and self.meta.get('path') != self.url_path:
+            self.discard()
+            self.offset, self.meta = 0, {}
+        request_headers = dict(headers or {})
+        if self.offset:
+            request_headers['Range'] = f'bytes={self.offset}-'
+            validator = self.meta.get('etag') or self.meta.get('last_modified')
+            if validator:
+                request_headers['If-Range'] = validator
+        return request_headers
+
+    def accept(self, status, response, retry_statuses=()):
+        # Returns (offset, total) for a usable response, total being 0 when
+        # unknown; raises IncompleteDownload when the next attempt should
+        # try again, DownloadError or DownloadTooLarge when it shouldn't
+        if status == 416:
+            # Our offset is past the end; the part file doesn't belong to this resource
+            self.discard()
+            raise IncompleteDownload(f"Range not satisfiable for {self.url}, restarting")
+        if status in retry_statuses:
+            raise IncompleteDownload(f"HTTP {status} for {self.url}")
+        if status not in (200, 206):
+            raise DownloadError(f"HTTP {status} for {self.url}")
+
+        offset = self.offset
+        start, total = content_range(response)
+        if status == 206 and offset and start == offset:
+            if total is None:
+                total = offset + content_length(response)
+            if self.meta.get('total') and total != self.meta['total']:
+                # Same path but a different size: the file changed underneath us
+                self.discard()
+                raise IncompleteDownload(f"{self.url} changed size, restarting")
+            log(f"Resuming {os.path.basename(self.filepath)} at {offset} bytes")
+            count('download_resumes')
+        elif status == 206 and start:
+            # A range we didn't ask for; drop it and fetch the whole file next time
+            self.discard()
+            raise IncompleteDownload(f"Unexpected range from {self.url}, restarting")
+        else:
+            # A 200 (or a 206 covering the whole file) is the whole body
+            offset = 0
+            if total is None:
+                total = content_length(response) if status == 200 else 0
+
+        if self.max_bytes and total and total > self.max_bytes:
+            self.discard()
+            raise DownloadTooLarge(f"{self.url} is {total} bytes, over the {self.max_bytes} byte limit")
+
+        with open(self.meta_path, 'w') as f:
+            json.dump({
+                'path': self.url_path,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'total': total,
+            }, f)
+        self.offset = offset
+        return offset, total
+
+    def hasher(self, digest_name):
+        # A hasher already fed what the part file holds, or None without digest_name
+        if not digest_name:
+            return None
+        hasher = hashlib.new(digest_name)
+        if self.offset:
+            with open(self.part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                    hasher.update(chunk)
+        return hasher
+
+    def check_size(self, downloaded):
+        # Servers that omit Content-Length are cut off once they pass the cap
+        if self.max_bytes and downloaded > self.max_bytes:
+            raise DownloadTooLarge(f"{self.url} exceeded the {self.max_bytes} byte limit")
+
+    def check_complete(self, downloaded, total, response):
+        # Content-Length counts encoded bytes, so only compare identity bodies
+        if total and downloaded < total and not response.headers.get('Content-Encoding'):
+            raise IncompleteDownload(f"Connection closed after {downloaded} of {total} bytes")
+
+    def finish(self):
+        os.replace(self.part_path, self.filepath)
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+
+
+def _write_body(response, partial, offset, total, chunk_size, progress, hasher=None):
+    downloaded = offset
+    with open(partial.part_path, 'ab' if offset else 'wb') as f:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if not chunk:
+                continue
+            downloaded += len(chunk)
+            partial.check_size(downloaded)
+            f.write(chunk)
+            if hasher:
+                hasher.update(chunk)
+            if progress:
+                progress(downloaded, total)
+    partial.check_complete(downloaded, total, response)
+    return downloaded
+
+
+def progress_events(url, progress=None):
+    # Wraps a progress callback so it also emits download_progress events,
+    # at most every PROGRESS_INTERVAL seconds plus once at the end
+    state = {'last': 0.0}
+    def report(downloaded, total):
+        if progress:
+            progress(downloaded, total)
+        now = time.monotonic()
+        if now - state['last'] >= PROGRESS_INTERVAL or (total and downloaded >= total):
+            state['last'] = now
+            emit(DOWNLOAD_PROGRESS, url=url, bytes=downloaded, total=total)
+    return report
+
+
+def download_file(url, filepath, session=None, headers=None, max_bytes=None, progress=None,
+                  retries=DEFAULT_RETRIES, first_response=None, chunk_size=CHUNK_SIZE, digest_name=None, **kwargs):
+    # Resumable download (see PartialDownload). Later attempts, including ones
+    # from a later run, ask for the rest with a Range + If-Range request and
+    # append when the server answers 206 from the right offset; anything else
+    # restarts from zero.
+    # `first_response` lets a caller that already opened the URL (e.g. to
+    # look at its Content-Type) hand that response in for the first attempt.
+    # With `digest_name` (e.g. "sha256") the content is hashed as it streams
+    # and (bytes, hexdigest) is returned instead of the byte count.
+    # Emits download_started, then download_finished (with bytes and
+    # seconds) or download_failed.
+    started = time.monotonic()
+    emit(DOWNLOAD_STARTED, url=url, path=filepath)
+    try:
+        result = _download_attempts(url, filepath, session, headers, max_bytes, progress_events(url, progress),
+                                    retries, first_response, chunk_size, digest_name, kwargs)
+    except Exception as e:
+        emit(DOWNLOAD_FAILED, url=url, path=filepath, error=str(e), seconds=round(time.monotonic() - started, 3))
+        raise
+    emit(DOWNLOAD_FINISHED, url=url, path=filepath, bytes=result[0] if digest_name else result,
+         seconds=round(time.monotonic() - started, 3))
+    return result
+
+
+def _download_attempts(url, filepath, session, headers, max_bytes, progress, retries, first_response, chunk_size,
+                       digest_name, kwargs):
+    session = session or get_session()
+    partial = PartialDownload(url, filepath, max_bytes)
+
+    for attempt in range(max(1, retries)):
+        request_headers = partial.headers(headers)
+        response = None
+        try:
+            if first_response is not None and attempt == 0 and not partial.offset:
+                response = first_response
+            else:
+                if first_response is not None:
+                    first_response.close()
+                response = session.get(url, headers=request_headers, stream=True, **kwargs)
+            first_response = None
+
+            offset, total = partial.accept(response.status_code, response)
+            hasher = partial.hasher(digest_name)
+            downloaded = _write_body(response, partial, offset, total, chunk_size, progress, hasher)
+            partial.finish()
+            if hasher:
+                return downloaded, hasher.hexdigest()
+            return downloaded
+
+        except DownloadTooLarge:
+            partial.discard()
+            raise
+        except (IncompleteDownload, requests.exceptions.RequestException) as e:
+            # Keep the .part file; the next attempt picks up where this one stopped
+            if attempt + 1 >= max(1, retries):
+                raise
+            log(f"Download of {url} interrupted ({e}), retrying", level='warning')
+            count('download_retries')
+            time.sleep(RETRY_BACKOFF * (2 ** attempt))
+        finally:
+            if response is not None:
+                response.close()
+
+
+def download_file_parallel(url, filepath, session=None, headers=None, max_bytes=None, progress=None,
+                           parts=PARALLEL_PARTS, min_size=PARALLEL_MIN_SIZE, retries=DEFAULT_RETRIES, **kwargs):
+    # Fetches a large file as `parts` byte ranges at once, each written at its
+    # offset in `<filepath>.parts`. A range that breaks off is retried from
+    # where it stopped. Files under min_size, or from servers that don't
+    # advertise byte ranges, go through download_file instead.
+    session = session or get_session()
+    head = session.head(url, headers=headers, allow_redirects=True, **kwargs)
+    total = content_length(head) if head.status_code == 200 else 0
+    if parts < 2 or total < max(min_size, 1) or head.headers.get('Accept-Ranges', '').lower() != 'bytes':
+        return download_file(head.url if head.status_code == 200 else url, filepath, session, headers=headers,
+                             max_bytes=max_bytes, progress=progress, retries=retries, **kwargs)
+    if max_bytes and total > max_bytes:
+        raise DownloadTooLarge(f"{url} is {total} bytes, over the {max_bytes} byte limit")
+
+    started = time.monotonic()
+    emit(DOWNLOAD_STARTED, url=url, path=filepath, parts=parts)
+    parts_path = filepath + '.parts'
+    report = progress_events(url, progress)
+    lock = threading.Lock()
+    state = {'downloaded': 0}
+
+    def advance(size):
+        with lock:
+            state['downloaded'] += size
+            report(state['downloaded'], total)
+
+    def fetch_range(start, end):
+        for attempt in range(max(1, retries)):
+            request_headers = dict(headers or {}, Range=f'bytes={start}-{end}')
+            try:
+                with session.get(head.url, headers=request_headers, stream=True, **kwargs) as response:
+                    if response.status_code != 206 or content_range(response)[0] != start:
+                        raise DownloadError(f"HTTP {response.status_code} for a range of {url}")
+                    with open(parts_path, 'r+b') as f:
+                        f.seek(start)
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            chunk = chunk[:end + 1 - start]
+                            f.write(chunk)
+                            start += len(chunk)
+                            advance(len(chunk))
+                if start > end:
+                    return
+                raise IncompleteDownload(f"Range of {url} closed {end + 1 - start} bytes early")
+            except (IncompleteDownload, requests.exceptions.RequestException) as e:
+                if attempt + 1 >= max(1, retries):
+                    raise
+                log(f"Range of {url} interrupted ({e}), retrying", level='warning')
+                count('download_retries')
+                time.sleep(RETRY_BACKOFF * (2 ** attempt))
+
+    try:
+        with open(parts_path, 'wb') as f:
+            f.truncate(total)
+        size = -(-total // parts)
+        with ThreadPoolExecutor(max_workers=parts) as executor:
+            futures = [executor.submit(propagate(fetch_range), start, min(start + size, total) - 1)
+                       for start in range(0, total, size)]
+            for future in futures:
+                future.result()
+        os.replace(parts_path, filepath)
+    except Exception as e:
+        if os.path.exists(parts_path):
+            os.remove(parts_path)
+        emit(DOWNLOAD_FAILED, url=url, path=filepath, error=str(e), seconds=round(time.monotonic() - started, 3))
+        raise
+    emit(DOWNLOAD_FINISHED, url=url, path=filepath, bytes=total, seconds=round(time.monotonic() - started, 3))
+    return total
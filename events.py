@@ -0,0 +1,149 @@
+import contextvars
+import functools
+import inspect
+import threading
+import time
+
+# Scrapers report what they do as events instead of printing. Every public
+# scrape function takes an `on_event` callback; it is called with an Event
+# from whichever thread the work happens on, so it must be thread-safe.
+# Without a callback the events' messages are printed, as before.
+
+LOG = "log"
+PAGE_FETCHED = "page_fetched"
+LISTING_FAILED = "listing_failed"
+POST_SKIPPED = "post_skipped"
+DOWNLOAD_STARTED = "download_started"
+DOWNLOAD_PROGRESS = "download_progress"
+DOWNLOAD_FINISHED = "download_finished"
+DOWNLOAD_FAILED = "download_failed"
+SCRAPE_FINISHED = "scrape_finished"
+# Instrumentation, see metrics.py
+STAGE_TIMED = "stage_timed"
+COUNTER = "counter"
+
+
+class Event:
+    __slots__ = ('type', 'message', 'level', 'fields', 'time')
+
+    def __init__(self, type, message=None, level='info', **fields):
+        self.type = type
+        self.message = message
+        self.level = level
+        self.fields = fields
+        self.time = time.time()
+
+    def get(self, name, default=None):
+        return self.fields.get(name, default)
+
+    def to_dict(self):
+        data = {'event': self.type, 'time': round(self.time, 3), 'level': self.level}
+        if self.message is not None:
+            data['message'] = self.message
+        data.update(self.fields)
+        return data
+
+    def __repr__(self):
+        return f"Event({self.type!r}, {self.message!r}, {self.fields!r})"
+
+
+def print_event(event):
+    # Default observer: the plain log lines the scrapers always printed
+    if event.message:
+        print(event.message)
+
+
+# The observer of the scrape running in the current thread or task. Threads
+# started on a scrape's behalf run in a copy of its context (see propagate),
+# so concurrent scrapes in one process each reach their own observer.
+_observer = contextvars.ContextVar('screddit_observer', default=print_event)
+
+
+def emit(type, message=None, level='info', **fields):
+    _observer.get()(Event(type, message, level, **fields))
+
+
+def log(message, level='info', **fields):
+    emit(LOG, message, level, **fields)
+
+
+def propagate(fn):
+    # Binds fn to a copy of the current context, for handing to another thread.
+    # Make one per submitted task: a context can't be entered by two threads.
+    context = contextvars.copy_context()
+    return functools.partial(context.run, fn)
+
+
+class observing:
+    def __init__(self, on_event):
+        self.on_event = on_event
+        self._token = None
+
+    def __enter__(self):
+        if self.on_event:
+            self._token = _observer.set(self.on_event)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._token is not None:
+            _observer.reset(self._token)
+
+
+class tagged:
+    # Adds `fields` to every event emitted inside the block, e.g. the job a
+    # batch runner thread is working on
+    def __init__(self, **fields):
+        self.fields = fields
+        self._token = None
+
+    def __enter__(self):
+        observer = _observer.get()
+        def tag(event):
+            for name, value in self.fields.items():
+                event.fields.setdefault(name, value)
+            observer(event)
+        self._token = _observer.set(tag)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _observer.reset(self._token)
+
+
+class collecting:
+    # Keeps the events of the given types emitted inside the block in
+    # `events` (from any thread the block's work runs on) and passes every
+    # event on, e.g. to find out whether a batch job's listing broke off
+    def __init__(self, *types):
+        self.types = types
+        self.events = []
+        self._lock = threading.Lock()
+        self._token = None
+
+    def __enter__(self):
+        observer = _observer.get()
+        def collect(event):
+            if event.type in self.types:
+                with self._lock:
+                    self.events.append(event)
+            observer(event)
+        self._token = _observer.set(collect)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _observer.reset(self._token)
+
+
+def observable(fn):
+    # Adds the `on_event=None` keyword to a scrape function (sync or async)
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, on_event=None, **kwargs):
+            with observing(on_event):
+                return await fn(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, on_event=None, **kwargs):
+        with observing(on_event):
+            return fn(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,107 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36'
+
+HTML_HEADERS = {
+    'Accept': 'text/html,application/xhtml+xml,application/xml',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+REDGIFS_API_HEADERS = {
+    'Referer': 'https://www.redgifs.com/',
+    'Accept': 'application/json',
+    'Origin': 'https://www.redgifs.com',
+}
+
+VIDEO_HEADERS = {
+    'Accept': 'video/webm,video/mp4,video/*;q=0.9,*/*;q=0.8',
+}
+
+# (connect, read) timeout in seconds used when a call doesn't pass its own
+DEFAULT_TIMEOUT = (10, 60)
+
+# Keep-alive connections kept open per host; media CDNs get the most because
+# the download pool talks to them concurrently
+HOST_POOL_SIZES = {
+    'www.reddit.com': 4,
+    'i.redd.it': 16,
+    'preview.redd.it': 16,
+    'external-preview.redd.it': 8,
+    'v.redd.it': 8,
+    'www.redgifs.com': 4,
+    'api.redgifs.com': 8,
+    'thumbs.redgifs.com': 8,
+    'thumbs1.redgifs.com': 8,
+    'thumbs2.redgifs.com': 8,
+    'thumbs3.redgifs.com': 8,
+    'thumbs4.redgifs.com': 8,
+    'thumbs5.redgifs.com': 8,
+}
+DEFAULT_POOL_SIZE = 8
+
+# Responses worth another try
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Hosts whose throttling and errors are retried by the caller (listing._fetch
+# through the adaptive rate limiter, which needs to see the 429s and their
+# rate-limit headers), so their adapters only retry connect and read errors
+CALLER_RETRIED_HOSTS = frozenset(['www.reddit.com'])
+
+
+class ScraperSession(requests.Session):
+    def __init__(self, timeout=DEFAULT_TIMEOUT, rate_limiter=None):
+        super().__init__()
+        self.timeout = timeout
+        # Optional rate_limit.HostRateLimiter consulted before every request
+        self.rate_limiter = rate_limiter
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        if self.rate_limiter:
+            self.rate_limiter.acquire(url)
+        return super().request(method, url, **kwargs)
+
+
+def make_retry(total=3, backoff_factor=0.5, statuses=RETRY_STATUSES):
+    # urllib3 retries 429/503 answers with a Retry-After header even when
+    # their status isn't listed, so that goes with the statuses
+    return Retry(
+        total=total,
+        connect=total,
+        read=total,
+        status=total,
+        backoff_factor=backoff_factor,
+        status_forcelist=statuses,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=bool(statuses),
+        raise_on_status=False,
+    )
+
+
+def create_session(timeout=DEFAULT_TIMEOUT, retries=3, backoff_factor=0.5, pool_sizes=None, rate_limiter=None):
+    session = ScraperSession(timeout=timeout, rate_limiter=rate_limiter)
+    session.headers['User-Agent'] = USER_AGENT
+    retry = make_retry(retries, backoff_factor)
+    caller_retry = make_retry(retries, backoff_factor, statuses=())
+    session.mount('https://', HTTPAdapter(pool_maxsize=DEFAULT_POOL_SIZE, max_retries=retry))
+    session.mount('http://', HTTPAdapter(pool_maxsize=DEFAULT_POOL_SIZE, max_retries=retry))
+    for host, size in (pool_sizes or HOST_POOL_SIZES).items():
+        host_retry = caller_retry if host in CALLER_RETRIED_HOSTS else retry
+        session.mount(f'https://{host}/', HTTPAdapter(pool_connections=1, pool_maxsize=size, max_retries=host_retry))
+    for host in CALLER_RETRIED_HOSTS - set(pool_sizes or HOST_POOL_SIZES):
+        session.mount(f'https://{host}/', HTTPAdapter(pool_maxsize=DEFAULT_POOL_SIZE, max_retries=caller_retry))
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
@@ -0,0 +1,211 @@
+import queue
+import threading
+import time
+import requests
+from http_session import get_session, RETRY_STATUSES
+from rate_limit import get_adaptive_limiter
+from events import log, emit, propagate, PAGE_FETCHED, LISTING_FAILED
+from metrics import count
+from posts import decode_listing
+
+_END = object()
+
+# Attempts per page before the listing gives up
+MAX_ATTEMPTS = 6
+
+
+class ListingPrefetcher:
+    # Walks a subreddit listing's `after` cursor on a background thread and keeps
+    # up to `lookahead` pages queued, so the next page is already fetched while
+    # the current one is being downloaded. Once the queued pages hold enough
+    # candidate posts to cover `remaining`, the listing thread pauses until the
+    # consumer asks for more with set_remaining(); with nothing queued and
+    # nothing wanted (remaining=0) the listing ends instead. `on_page` is
+    # called from the consumer's thread with the cursor that fetched each page
+    # as it is handed out, which is what a resumed run should start from.
+    # Requests are paced by the host's adaptive limiter and throttled pages
+    # are retried.
+
+    def __init__(self, url, session=None, page_size=100, lookahead=2, is_candidate=None, remaining=None,
+                 verbose=False, after=None, on_page=None, limiter=None):
+        self.url = url
+        self.session = session or get_session()
+        self.limiter = limiter or get_adaptive_limiter(url)
+        self.page_size = page_size
+        self.is_candidate = is_candidate
+        self.verbose = verbose
+        self.on_page = on_page
+        self.start_after = after
+        self.after = after
+        # Set when the listing stopped on an error rather than running out of pages
+        self.failed = False
+        self._pages = queue.Queue(maxsize=max(1, lookahead))
+        self._cond = threading.Condition()
+        self._queued_candidates = 0
+        self._remaining = remaining
+        self._stopped = False
+        # Held while a fetched page is decoded and handed to the callbacks, so
+        # close() can make sure none of them runs once it has returned
+        self._processing = threading.Lock()
+        self._thread = threading.Thread(target=propagate(self._produce), daemon=True)
+        self._thread.start()
+
+    def set_remaining(self, remaining):
+        with self._cond:
+            self._remaining = remaining
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        # Unblock the listing thread if it is waiting on a full queue
+        while True:
+            try:
+                self._pages.get_nowait()
+            except queue.Empty:
+                break
+        # A page fetch still in flight is only waited for up to a second, but a
+        # page already being processed is let finish: after this the thread
+        # sees _stopped and drops whatever it fetches
+        with self._processing:
+            pass
+        self._thread.join(timeout=1)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def pages(self):
+        while True:
+            item = self._pages.get()
+            if item is _END:
+                return
+            posts, candidates, after, cursor = item
+            with self._cond:
+                self._queued_candidates -= candidates
+                self._cond.notify_all()
+            if self.on_page:
+                self.on_page(cursor)
+            yield posts
+            # Only advance once the consumer is done with the page
+            self.after = after
+
+    def __iter__(self):
+        for posts in self.pages():
+            yield from posts
+
+    def _wait_for_demand(self):
+        # False once the listing was closed or the consumer wants no more posts
+        with self._cond:
+            while not self._stopped and self._remaining is not None and self._queued_candidates >= self._remaining:
+                if self._remaining <= 0 and not self._queued_candidates and self._pages.empty():
+                    return False
+                self._cond.wait()
+            return not self._stopped
+
+    def _sleep(self, delay):
+        # Returns False if the listing was closed while waiting
+        with self._cond:
+            if delay > 0:
+                self._cond.wait_for(lambda: self._stopped, timeout=delay)
+            return not self._stopped
+
+    def _fetch(self, params):
+        for attempt in range(MAX_ATTEMPTS):
+            if not self._sleep(self.limiter.reserve()):
+                return None
+            try:
+                response = self.session.get(self.url, params=params)
+            except requests.exceptions.RequestException as e:
+                if attempt + 1 >= MAX_ATTEMPTS:
+                    raise
+                delay = self.limiter.backoff(None, attempt)
+                if not self._report_retry(f"Error fetching page ({e}), retrying in {delay:.1f}s", 'error'):
+                    return None
+                continue
+            self.limiter.update(response)
+            if response.status_code not in RETRY_STATUSES or attempt + 1 >= MAX_ATTEMPTS:
+                return response
+            delay = self.limiter.backoff(response, attempt)
+            if not self._report_retry(f"Reddit answered {response.status_code}, retrying in {delay:.1f}s", 'warning'):
+                return None
+        return response
+
+    def _report_retry(self, message, level):
+        # Like the page callbacks, retries aren't reported once close() has
+        # returned; False if the listing was closed
+        with self._processing:
+            if self._stopped:
+                return False
+            log(message, level=level)
+            count('listing_retries')
+            return True
+
+    def _put(self, item):
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return False
+            try:
+                self._pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+    def _produce(self):
+        after = self.start_after
+        try:
+            while self._wait_for_demand():
+                params = {'limit': self.page_size}
+                if after:
+                    params['after'] = after
+                if self.verbose:
+                    with self._processing:
+                        if self._stopped:
+                            return
+                        log(f"Fetching Reddit page: {self.url} with params {params}")
+                started = time.monotonic()
+                response = self._fetch(params)
+                if response is None:
+                    return
+                with self._processing:
+                    # The consumer may have stopped (and closed its state)
+                    # while the page was in flight
+                    if self._stopped:
+                        return
+                    if response.status_code != 200:
+                        emit(LISTING_FAILED, f"Failed to fetch page: {response.status_code}", 'error', url=self.url,
+                             status=response.status_code)
+                        self.failed = True
+                        break
+                    data = decode_listing(response.content)
+                    posts = [post.get('data', {}) for post in data.get('data', {}).get('children', [])]
+                    if not posts:
+                        if self.verbose:
+                            log("No more posts found.")
+                        break
+                    emit(PAGE_FETCHED, f"Found {len(posts)} posts to process" if self.verbose else None,
+                         url=self.url, cursor=after, posts=len(posts), seconds=round(time.monotonic() - started, 3))
+                    candidates = len(posts)
+                    if self.is_candidate:
+                        candidates = sum(1 for post_data in posts if self.is_candidate(post_data))
+                    cursor = after
+                    after = data.get('data', {}).get('after')
+                    with self._cond:
+                        self._queued_candidates += candidates
+                if not self._put((posts, candidates, after, cursor)):
+                    return
+                if not after:
+                    if self.verbose:
+                        log("No more pages available.")
+                    break
+        except Exception as e:
+            with self._processing:
+                if self._stopped:
+                    return
+                emit(LISTING_FAILED, f"Error processing page: {e}", 'error', url=self.url, error=str(e))
+                self.failed = True
+        self._put(_END)
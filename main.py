@@ -1,24 +1,31 @@
 import customtkinter as ctk
-import tkinter as tk
 from tkinter import filedialog
 import os
+import queue
 import threading
-from PIL import Image, ImageTk
-import sys
-from reddit_image_scraper import scrape_subreddit_images
-from reddit_video_scraper import scrape_subreddit_videos
-from third_party_gif import scrape_gif_videos
+# The scrapers (and requests under them) are imported when a download starts,
+# not at startup, so the window comes up without waiting on them
 
 ctk.set_appearance_mode("System")  
 ctk.set_default_color_theme("blue")
 
+# The log is fed from the download thread through a queue that the Tk loop
+# empties every LOG_POLL_MS, at most LOG_BATCH_SIZE messages at a time
+LOG_POLL_MS = 100
+LOG_BATCH_SIZE = 500
+# Oldest lines are dropped from the Activity Log past this many
+MAX_LOG_LINES = 2000
+
+def is_progress_line(line):
+    return line.startswith("Download progress:") or (line.startswith("Downloaded ") and line.endswith(" MB"))
+
 class screddit(ctk.CTk):
     def __init__(self):
         super().__init__()
 
         # Configure window
         self.title("Screddit")
-        self.geometry("600x650")
+        self.geometry("680x650")
         self.minsize(500, 600)
         
         # Set window icon
@@ -91,6 +98,10 @@ class screddit(ctk.CTk):
                                              variable=self.media_type_var, value="Third-party gifs")
         self.gif_radio.pack(side="left", padx=20)
         
+        self.all_radio = ctk.CTkRadioButton(self.media_frame, text="All", 
+                                             variable=self.media_type_var, value="all")
+        self.all_radio.pack(side="left", padx=20)
+        
         # Limit input
         self.limit_frame = ctk.CTkFrame(self.main_frame)
         self.limit_frame.pack(fill="x", pady=10, padx=20)
@@ -151,16 +162,50 @@ class screddit(ctk.CTk):
         # Bind subreddit entry changes to update folder name
         self.subreddit_var.trace_add("write", self.on_subreddit_change)
         
+        # Widgets are only touched from the Tk loop; other threads post here
+        self.events = queue.Queue()
+        self.after(LOG_POLL_MS, self.process_events)
+        
     def log_message(self, message):
+        # Safe to call from any thread
+        self.events.put(("log", message))
+        
+    def update_status(self, message):
+        self.events.put(("status", message))
+        
+    def handle_event(self, event):
+        # Scraper events arrive on download threads; only their messages are shown
+        if event.message:
+            self.log_message(event.message)
+        
+    def process_events(self):
+        lines = []
+        try:
+            for _ in range(LOG_BATCH_SIZE):
+                kind, value = self.events.get_nowait()
+                if kind == "log":
+                    lines.append(value)
+                elif kind == "status":
+                    self.status_var.set(value)
+                elif kind == "finished":
+                    self.download_button.configure(state="normal")
+        except queue.Empty:
+            pass
+        if lines:
+            self.append_log(lines)
+        self.after(LOG_POLL_MS, self.process_events)
+        
+    def append_log(self, lines):
+        # A progress line is stale as soon as the next one arrives
+        lines = [line for i, line in enumerate(lines)
+                 if not (is_progress_line(line) and i + 1 < len(lines) and is_progress_line(lines[i + 1]))]
         self.log_text.configure(state="normal")
-        self.log_text.insert("end", f"{message}\n")
+        self.log_text.insert("end", "\n".join(lines) + "\n")
+        line_count = int(self.log_text.index("end-1c").split(".")[0]) - 1
+        if line_count > MAX_LOG_LINES:
+            self.log_text.delete("1.0", f"{line_count - MAX_LOG_LINES + 1}.0")
         self.log_text.see("end")
         self.log_text.configure(state="disabled")
-        self.update_idletasks()
-        
-    def update_status(self, message):
-        self.status_var.set(message)
-        self.update_idletasks()
         
     def browse_folder(self):
         folder = filedialog.askdirectory()
@@ -221,6 +266,9 @@ class screddit(ctk.CTk):
             output_dir = os.path.join(base_dir, "images")
         elif media_type == "videos":
             output_dir = os.path.join(base_dir, "videos")
+        elif media_type == "all":
+            # The combined scraper creates the images/videos/redgif_videos subfolders itself
+            output_dir = base_dir
         else:
             output_dir = os.path.join(base_dir, "redgif_videos")
             
@@ -228,46 +276,41 @@ class screddit(ctk.CTk):
         os.makedirs(output_dir, exist_ok=True)
             
         # Start download in a separate thread
-        download_thread = threading.Thread(target=self.download_media, args=(output_dir,))
+        # Tk variables are read here because the download thread mustn't touch them
+        download_thread = threading.Thread(target=self.download_media,
+                                           args=(output_dir, subreddit, self.sort_var.get(), media_type,
+                                                 int(self.limit_var.get())))
         download_thread.daemon = True
         download_thread.start()
         
-    def download_media(self, output_dir):
+    def download_media(self, output_dir, subreddit, sort_type, media_type, limit):
         try:
-            subreddit = self.subreddit_var.get().strip()
-            sort_type = self.sort_var.get()
-            media_type = self.media_type_var.get()
-            limit = int(self.limit_var.get())
-            
             self.log_message(f"Starting download from r/{subreddit} ({sort_type})")
             self.log_message(f"Saving to: {output_dir}")
             
-            class StdoutRedirector:
-                def __init__(self, app):
-                    self.app = app
-                    
-                def write(self, text):
-                    if text.strip():  # Only log non-empty lines
-                        self.app.log_message(text.strip())
-                    
-                def flush(self):
-                    pass
-                    
-            original_stdout = sys.stdout
-            sys.stdout = StdoutRedirector(self)
+            from reddit_image_scraper import scrape_subreddit_images
+            from reddit_video_scraper import scrape_subreddit_videos
+            from third_party_gif import scrape_gif_videos
+            from media_scraper import scrape_subreddit_media
+            from metrics import RunMetrics
+            metrics = RunMetrics(forward=self.handle_event)
               # Call the appropriate scraper function
-            if media_type == "images":                scrape_subreddit_images(subreddit, sort_type=sort_type, 
-                                        output_dir=output_dir, limit=limit)
+            if media_type == "images":
+                scrape_subreddit_images(subreddit, sort_type=sort_type, 
+                                        output_dir=output_dir, limit=limit, on_event=metrics)
             elif media_type == "videos":
                 scrape_subreddit_videos(subreddit, sort_type=sort_type, 
-                                        output_dir=output_dir, limit=limit)
+                                        output_dir=output_dir, limit=limit, on_event=metrics)
+            elif media_type == "all":
+                scrape_subreddit_media(subreddit, sort_type=sort_type, output_dir=output_dir,
+                                       limits={'images': limit, 'videos': limit, 'gifs': limit},
+                                       on_event=metrics)
             else:
                 scrape_gif_videos(subreddit, sort_type=sort_type, 
-                                   output_dir=output_dir, limit=limit)
-                
-            # Restore stdout
-            sys.stdout = original_stdout
+                                   output_dir=output_dir, limit=limit, on_event=metrics)
             
+            for line in metrics.report():
+                self.log_message(line)
             self.log_message(f"Download completed!")
             self.update_status("Download completed")
             
@@ -276,7 +319,7 @@ class screddit(ctk.CTk):
             self.update_status("Error occurred")
         finally:
             # Re-enable the download button
-            self.download_button.configure(state="normal")
+            self.events.put(("finished", None))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,178 @@
+import os
+from download_pool import DownloadPool
+from listing import ListingPrefetcher
+from http_session import get_session
+from scrape_state import ScrapeState, IncrementalScrape, post_id
+from dedup_store import get_dedup_store
+from events import emit, observable, POST_SKIPPED, SCRAPE_FINISHED
+from reddit_image_scraper import image_items, download_image
+from reddit_video_scraper import find_video_url, download_video
+from variants import pick_video_variant, rendition_key
+from third_party_gif import find_redgif_url, resolve_gif_urls, download_gif_video, REDGIFS_BATCH_SIZE
+
+# Media type -> (subfolder, state kind); the subfolders match the GUI's so the
+# single-type scrapers and this one share numbering and incremental state
+MEDIA_TYPES = {
+    'images': ('images', 'image'),
+    'videos': ('videos', 'video'),
+    'gifs': ('redgif_videos', 'redgif'),
+}
+
+DEFAULT_LIMITS = {'images': 50, 'videos': 50, 'gifs': 50}
+
+
+def classify_post(post_data, max_width=None, max_height=None):
+    # Routes a listing post to the handler that can fetch it. Returns
+    # (media_type, [(item_post_data, url), ...]) or (None, []). Galleries come
+    # first; video and Redgifs posts are checked before single images because
+    # they also carry a preview thumbnail. Image URLs are downscaled to the
+    # size limits where the listing has a smaller copy.
+    if post_data.get('is_gallery'):
+        items = image_items(post_data, max_width, max_height)
+        if items:
+            return 'images', items
+    video_url = find_video_url(post_data)
+    if video_url:
+        return 'videos', [(post_data, video_url)]
+    redgif_url = find_redgif_url(post_data)
+    if redgif_url:
+        return 'gifs', [(post_data, redgif_url)]
+    items = image_items(post_data, max_width, max_height)
+    if items:
+        return 'images', items
+    return None, []
+
+
+def _download_redgif(slot, video_url, session, output_dir, base_index, state, post_data, max_bytes):
+    index = base_index + slot
+    filename = download_gif_video(video_url, post_data, output_dir, index, session, max_bytes)
+    if filename and state:
+        state.record(post_id(post_data), 'redgif', index, filename)
+    return filename is not None
+
+
+@observable
+def scrape_subreddit_media(subreddit_name, sort_type="hot", output_dir="reddit_media", limits=None,
+                           max_workers=8, per_host_limit=4, lookahead=2, incremental=True, max_bytes=None,
+                           dedup='link', dedup_store=None, batch_size=REDGIFS_BATCH_SIZE, cache=None, session=None, executor=None,
+                           max_width=None, max_height=None, audio=True):
+    # One crawl of the listing feeds every media type at once. `limits` maps
+    # 'images' / 'videos' / 'gifs' to how many of each to download; types left
+    # out (or set to 0) are not fetched. Gallery items count as images.
+    # max_width / max_height cap image sizes and max_height the v.redd.it
+    # rendition, and audio fetches Reddit videos with sound, as in the
+    # single-type scrapers.
+    url = f"https://www.reddit.com/r/{subreddit_name}/{sort_type}.json"
+    session = session or get_session()
+    limits = {media_type: limit for media_type, limit in (limits or DEFAULT_LIMITS).items()
+              if media_type in MEDIA_TYPES and limit > 0}
+    if not limits:
+        return {}
+    if dedup:
+        dedup_store = dedup_store or get_dedup_store()
+    
+    folders = {}
+    states = {}
+    pools = {}
+    base_indexes = {}
+    for media_type, limit in limits.items():
+        subfolder, kind = MEDIA_TYPES[media_type]
+        folders[media_type] = os.path.join(output_dir, subfolder)
+        os.makedirs(folders[media_type], exist_ok=True)
+        states[media_type] = ScrapeState(folders[media_type]) if incremental else None
+        base_indexes[media_type] = states[media_type].next_index(kind) if incremental else 0
+        pools[media_type] = DownloadPool(limit, max_workers=max_workers, per_host_limit=per_host_limit,
+                                         executor=executor)
+    
+    # The combined crawl keeps its own resume cursor next to the subfolders
+    run = IncrementalScrape(output_dir, subreddit_name, sort_type, incremental, listing='media')
+    
+    def is_new(media_type, item):
+        state = states[media_type]
+        return not (state and state.is_seen(post_id(item), MEDIA_TYPES[media_type][1]))
+    
+    def wanted(post_data):
+        media_type, items = classify_post(post_data)
+        if media_type not in pools or pools[media_type].remaining() <= 0:
+            return None, []
+        return media_type, [(item, item_url) for item, item_url in items if is_new(media_type, item)]
+    
+    def is_candidate(post_data):
+        return bool(wanted(post_data)[1])
+    
+    def remaining():
+        return sum(pool.remaining() for pool in pools.values())
+    
+    def finished():
+        return all(pool.completed >= pool.limit for pool in pools.values())
+    
+    def submit(media_type, item, item_url, fn, *args):
+        pool = pools[media_type]
+        if pool.completed >= pool.limit or not pool.wait_for_slot():
+            return
+        pool.submit(item_url, fn, item_url, session, folders[media_type], base_indexes[media_type],
+                    states[media_type], item, max_bytes, *args)
+    
+    failed = True
+    try:
+        with ListingPrefetcher(url, session, lookahead=lookahead, is_candidate=is_candidate, remaining=remaining(),
+                               after=run.resume_after, on_page=run.save_cursor) as listing:
+            for posts in listing.pages():
+                redgifs = []
+                reached_known = False
+                for post_data in posts:
+                    media_type, items = classify_post(post_data, max_width, max_height)
+                    if media_type not in pools or not items:
+                        continue
+                    new_items = [(item, item_url) for item, item_url in items if is_new(media_type, item)]
+                    if not new_items:
+                        emit(POST_SKIPPED, post_id=post_id(post_data), reason='seen')
+                        if run.stop_at_known():
+                            reached_known = True
+                            break
+                        continue
+                    for item, item_url in new_items:
+                        if media_type == 'images':
+                            submit(media_type, item, item_url, download_image, dedup, dedup_store,
+                                   rendition_key(max_width, max_height))
+                        elif media_type == 'videos':
+                            submit(media_type, item, pick_video_variant(item_url, max_height) or item_url,
+                                   download_video, dedup, dedup_store, audio, max_height)
+                        else:
+                            redgifs.append((item, item_url))
+                
+                # Redgifs links are resolved together, a batch at a time
+                gif_pool = pools.get('gifs')
+                while redgifs and gif_pool and gif_pool.wait_for_slot():
+                    batch = redgifs[:min(batch_size, gif_pool.remaining())]
+                    redgifs = redgifs[len(batch):]
+                    resolved = resolve_gif_urls([item_url for _, item_url in batch], session, batch_size, cache=cache)
+                    for item, item_url in batch:
+                        if resolved.get(item_url):
+                            submit('gifs', item, resolved[item_url], _download_redgif)
+                
+                if reached_known:
+                    break
+                # With every wanted download in flight, wait for one to end: a
+                # failed one hands its slot back to be refilled from later pages
+                while remaining() <= 0 and not finished():
+                    next(pool for pool in pools.values() if pool.completed < pool.limit).wait_for_slot()
+                if finished():
+                    break
+                listing.set_remaining(remaining())
+        
+        counts = {media_type: pool.drain() for media_type, pool in pools.items()}
+        failed = listing.failed
+    finally:
+        for pool in pools.values():
+            pool.drain()
+            pool.shutdown()
+        for state in states.values():
+            if state:
+                state.close()
+        run.finish(failed)
+    
+    for media_type, count in counts.items():
+        emit(SCRAPE_FINISHED, f"Total {media_type} downloaded: {count}", subreddit=subreddit_name, media=media_type,
+             count=count)
+    return counts
@@ -0,0 +1,171 @@
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+import events
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Durations kept per stage for percentiles; counts and sums stay exact past it
+MAX_SAMPLES = 10000
+
+
+@contextmanager
+def timed(stage, **fields):
+    # Times a block, or a function when used as a decorator, and reports it
+    # as a stage_timed event
+    started = time.monotonic()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        events.emit(events.STAGE_TIMED, stage=stage, seconds=time.monotonic() - started, ok=ok, **fields)
+
+
+def count(name, value=1):
+    if value:
+        events.emit(events.COUNTER, name=name, value=value)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.samples = []
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.bucket_counts[index] += 1
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(value)
+
+    def percentile(self, fraction):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 4),
+            'min': round(self.min, 4) if self.min is not None else None,
+            'max': round(self.max, 4) if self.max is not None else None,
+            'p50': round(self.percentile(0.5), 4) if self.samples else None,
+            'p95': round(self.percentile(0.95), 4) if self.samples else None,
+        }
+
+
+class RunMetrics:
+    # Observer that turns a run's events into per-stage latency histograms
+    # and counters; pass it as a scraper's on_event. Events are forwarded to
+    # `forward` (e.g. the CLI or GUI observer) so logging keeps working.
+    #
+    # Stages: listing_fetch, download, redgifs_token, redgifs_api,
+    # redgifs_api_batch, redgifs_page, redgifs_probe and redgifs_resolve.
+
+    def __init__(self, forward=None):
+        self.forward = forward
+        self.stages = {}
+        self.counters = {}
+        self.started = time.time()
+        self.finished = self.started
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            self.finished = event.time
+            if event.type == events.STAGE_TIMED:
+                self._observe(event.get('stage'), event.get('seconds'))
+            elif event.type == events.COUNTER:
+                self._count(event.get('name'), event.get('value', 1))
+            elif event.type == events.PAGE_FETCHED:
+                self._observe('listing_fetch', event.get('seconds'))
+                self._count('listing_pages')
+                self._count('listing_posts', event.get('posts', 0))
+            elif event.type == events.DOWNLOAD_FINISHED:
+                self._observe('download', event.get('seconds'))
+                self._count('downloads')
+                self._count('downloaded_bytes', event.get('bytes', 0))
+            elif event.type == events.DOWNLOAD_FAILED:
+                self._count('download_failures')
+            elif event.type == events.POST_SKIPPED:
+                self._count(f"posts_skipped_{event.get('reason', 'other')}")
+            elif event.type == events.LISTING_FAILED:
+                self._count('listing_failures')
+        if self.forward:
+            self.forward(event)
+
+    def _observe(self, stage, seconds):
+        if stage and seconds is not None:
+            self.stages.setdefault(stage, Histogram()).observe(seconds)
+
+    def _count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        with self._lock:
+            elapsed = max(self.finished - self.started, 1e-9)
+            downloaded = self.counters.get('downloaded_bytes', 0)
+            download = self.stages.get('download')
+            return {
+                'elapsed_seconds': round(elapsed, 3),
+                'stages': {stage: histogram.summary() for stage, histogram in sorted(self.stages.items())},
+                'counters': dict(sorted(self.counters.items())),
+                # Overall rate over the run, and the average rate of a single transfer
+                'bytes_per_second': round(downloaded / elapsed, 1),
+                'transfer_bytes_per_second': round(downloaded / download.sum, 1) if download and download.sum else None,
+            }
+
+    def to_json(self, indent=2):
+        return json.dumps(self.summary(), indent=indent)
+
+    def to_prometheus(self, prefix="screddit"):
+        with self._lock:
+            lines = [
+                f"# HELP {prefix}_stage_seconds Time spent per stage of a run",
+                f"# TYPE {prefix}_stage_seconds histogram",
+            ]
+            for stage, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        # Human-readable summary, one line per stage and counter
+        summary = self.summary()
+        lines = [f"Run took {summary['elapsed_seconds']:.1f}s, "
+                 f"{summary['counters'].get('downloaded_bytes', 0) / 1048576:.1f} MB at "
+                 f"{summary['bytes_per_second'] / 1048576:.2f} MB/s"]
+        for stage, stats in summary['stages'].items():
+            lines.append(f"{stage}: {stats['count']} in {stats['sum']:.2f}s "
+                         f"(p50 {stats['p50']:.3f}s, p95 {stats['p95']:.3f}s, max {stats['max']:.3f}s)")
+        for name, value in summary['counters'].items():
+            if name != 'downloaded_bytes':
+                lines.append(f"{name}: {value}")
+        return lines
+
+    def write(self, path):
+        # Prometheus text for *.prom / *.txt, JSON otherwise
+        text = self.to_prometheus() if path.endswith(('.prom', '.txt')) else self.to_json()
+        with open(path, 'w') as f:
+            f.write(text)
@@ -0,0 +1,111 @@
+import json
+
+# Listing pages are decoded straight into compact Post records: every
+# child's data object is trimmed to the fields the scrapers read as soon as
+# the decoder closes it, so the rest of it (awards, flair, preview variants,
+# crosspost copies, HTML bodies...) is freed while the page is still being
+# parsed instead of living in the prefetch queue.
+
+REDDIT_VIDEO_FIELDS = ('fallback_url', 'dash_url', 'hls_url', 'height', 'width', 'bitrate_kbps', 'duration',
+                       'is_gif', 'has_audio')
+MEDIA_METADATA_FIELDS = ('status', 'e', 'm', 's', 'p')
+
+
+def _reddit_video(media):
+    video = (media or {}).get('reddit_video')
+    if not video:
+        return None
+    return {'reddit_video': {key: video[key] for key in REDDIT_VIDEO_FIELDS if key in video}}
+
+
+def _preview(preview):
+    # Only the first image's source and resolutions; the gif / mp4 / blurred
+    # variants are dropped
+    images = (preview or {}).get('images')
+    if not images:
+        return None
+    image = images[0]
+    return {'images': [{'source': image.get('source') or {}, 'resolutions': image.get('resolutions') or []}]}
+
+
+def _media_metadata(metadata):
+    if not metadata:
+        return None
+    return {media_id: {key: media[key] for key in MEDIA_METADATA_FIELDS if key in media}
+            for media_id, media in metadata.items() if isinstance(media, dict)}
+
+
+def _gallery_data(gallery_data):
+    items = (gallery_data or {}).get('items')
+    if not items:
+        return None
+    return {'items': [{'media_id': item.get('media_id'), 'id': item.get('id')} for item in items]}
+
+
+def _selftext(selftext):
+    # The body is only ever searched for Redgifs links
+    return selftext if selftext and 'redgifs.com' in selftext else None
+
+
+# Field -> trimming function, or None to keep the value as is
+FIELDS = {
+    'name': None,
+    'id': None,
+    'title': None,
+    'url': None,
+    'permalink': None,
+    'subreddit': None,
+    'created_utc': None,
+    'post_hint': None,
+    'is_video': None,
+    'is_gallery': None,
+    'is_self': None,
+    'over_18': None,
+    'crosspost_parent': None,
+    'selftext': _selftext,
+    'media': _reddit_video,
+    'preview': _preview,
+    'media_metadata': _media_metadata,
+    'gallery_data': _gallery_data,
+}
+
+
+class Post:
+    # Read-only stand-in for a listing child's data dict: get(), [] and `in`
+    # work as on the dict for the kept fields, and fields that were null or
+    # trimmed away read as missing
+    __slots__ = tuple(FIELDS)
+
+    def __init__(self, data):
+        for field, trim in FIELDS.items():
+            value = data.get(field)
+            setattr(self, field, trim(value) if trim and value is not None else value)
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in FIELDS else None
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __repr__(self):
+        return f"Post({self.name or self.id!r})"
+
+
+def _listing_object(obj):
+    # object_hook: objects close innermost first, so a child's data has been
+    # decoded in full by the time its {"kind": "t3", "data": ...} wrapper closes
+    if obj.get('kind') == 't3' and isinstance(obj.get('data'), dict):
+        obj['data'] = Post(obj['data'])
+    return obj
+
+
+def decode_listing(text):
+    # json.loads for a listing page; children's data become Post records
+    return json.loads(text, object_hook=_listing_object)
@@ -0,0 +1,163 @@
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+# Requests per second and burst size per host. A key starting with "." covers
+# every subdomain; hosts without a rule get DEFAULT_RATE_LIMIT each.
+DEFAULT_RATE_LIMITS = {
+    'www.reddit.com': (1.0, 5),
+    'www.redgifs.com': (1.0, 4),
+    'api.redgifs.com': (2.0, 10),
+}
+DEFAULT_RATE_LIMIT = (25.0, 50)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        # Blocks until `tokens` are available; returns the seconds spent waiting
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class HostRateLimiter:
+    # One token bucket per host (or per "."-suffix rule), shared by every
+    # thread that sends requests through the session it is attached to
+
+    def __init__(self, rates=None, default=DEFAULT_RATE_LIMIT):
+        self.rates = dict(DEFAULT_RATE_LIMITS if rates is None else rates)
+        self.default = default
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _rule(self, host):
+        if host in self.rates:
+            return host, self.rates[host]
+        for key, rate in self.rates.items():
+            if key.startswith('.') and host.endswith(key):
+                return key, rate
+        return host, self.default
+
+    def bucket(self, url):
+        key, (rate, burst) = self._rule(urlparse(url).netloc.lower())
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(rate, burst)
+                self._buckets[key] = bucket
+            return bucket
+
+    def acquire(self, url):
+        return self.bucket(url).acquire()
+
+
+# Listing pages are sent freely until the server reports this few requests
+# left in its window; after that the rest are spread over what's left of it
+LOW_WATERMARK = 10
+# Exponential backoff for 429/5xx answers without a Retry-After header
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+
+def _header_float(response, name):
+    try:
+        return float(response.headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveRateLimiter:
+    # Follows the budget a server advertises in X-Ratelimit-Remaining /
+    # X-Ratelimit-Reset (Reddit sends both on every listing response) and
+    # holds every caller back after a 429 or 5xx. reserve() doesn't sleep
+    # itself, it returns how long to wait, so both the threaded listing and
+    # the asyncio engine can use the same limiter.
+
+    def __init__(self, low_watermark=LOW_WATERMARK, backoff_base=BACKOFF_BASE, backoff_cap=BACKOFF_CAP):
+        self.low_watermark = low_watermark
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._remaining = None
+        self._reset_at = None
+        self._next_allowed = 0.0
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        # Claims the next request slot; returns the seconds to wait before sending
+        with self._lock:
+            now = time.monotonic()
+            if self._reset_at is not None and now >= self._reset_at:
+                # A new window started; its budget is unknown until the next response
+                self._remaining, self._reset_at = None, None
+            start = max(now, self._next_allowed, self._blocked_until)
+            interval = 0.0
+            if self._remaining is not None and self._reset_at is not None:
+                window = max(0.0, self._reset_at - start)
+                if self._remaining < 1:
+                    start = max(start, self._reset_at)
+                elif self._remaining <= self.low_watermark:
+                    interval = window / self._remaining
+                self._remaining -= 1
+            self._next_allowed = start + interval
+            return start - now
+
+    def wait(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def update(self, response):
+        remaining = _header_float(response, 'X-Ratelimit-Remaining')
+        reset = _header_float(response, 'X-Ratelimit-Reset')
+        if remaining is None or reset is None:
+            return
+        with self._lock:
+            self._remaining = remaining
+            self._reset_at = time.monotonic() + reset
+
+    def backoff(self, response=None, attempt=0):
+        # Blocks further requests after a throttled or failed one and returns the delay
+        retry_after = _header_float(response, 'Retry-After') if response is not None else None
+        if retry_after is not None:
+            delay = retry_after + random.uniform(0, 1)
+        else:
+            # Jitter keeps concurrent listings from retrying in lockstep
+            ceiling = min(self.backoff_cap, self.backoff_base * (2 ** attempt))
+            delay = random.uniform(ceiling / 2, ceiling)
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+        return delay
+
+
+_adaptive_limiters = {}
+_adaptive_limiters_lock = threading.Lock()
+
+
+def get_adaptive_limiter(url):
+    # One limiter per host, shared by every listing in the process
+    host = urlparse(url).netloc.lower()
+    with _adaptive_limiters_lock:
+        limiter = _adaptive_limiters.get(host)
+        if limiter is None:
+            limiter = AdaptiveRateLimiter()
+            _adaptive_limiters[host] = limiter
+        return limiter
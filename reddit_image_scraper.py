@@ -1,52 +1,153 @@
-import requests
 import os
-import re
+from urllib.parse import urlparse
+from download_pool import DownloadPool
+from listing import ListingPrefetcher
+from http_session import get_session
+from scrape_state import IncrementalScrape, post_id
+from downloader import download_file
+from dedup_store import fetch_deduplicated, get_dedup_store
+from events import log, emit, observable, POST_SKIPPED, SCRAPE_FINISHED
+from variants import preview_variant, gallery_variant, rendition_key
+from url_classifier import classify_url, IMAGE
 
-def scrape_subreddit_images(subreddit_name, sort_type="hot", output_dir="reddit_images", limit=50):
+def find_image_url(post_data):
+    # Check for direct image links or Reddit-hosted images. The preview is
+    # only a fallback for posts without a post_hint: link and video posts
+    # carry a preview thumbnail too.
+    img_url = None
+    if post_data.get('post_hint') == 'image' and 'url' in post_data:
+        img_url = post_data['url']
+    elif (not post_data.get('post_hint') and not post_data.get('is_video') and 'preview' in post_data
+          and 'images' in post_data['preview']):
+        img_url = post_data['preview']['images'][0]['source']['url']
+        img_url = img_url.replace('&amp;', '&')
+    match = classify_url(img_url)
+    return match.url if match and match.kind == IMAGE else None
+
+def find_gallery_urls(post_data, max_width=None, max_height=None):
+    # Gallery posts list their items in gallery_data (in display order) and
+    # keep each item's source in media_metadata; returns [(media_id, url)].
+    # With max_width / max_height still images come from the item's
+    # resolutions instead (see variants.py).
+    if not post_data.get('is_gallery'):
+        return []
+    metadata = post_data.get('media_metadata') or {}
+    items = (post_data.get('gallery_data') or {}).get('items') or [{'media_id': media_id} for media_id in metadata]
+    urls = []
+    for item in items:
+        media = metadata.get(item.get('media_id'), {})
+        if media.get('status') != 'valid':
+            continue
+        source = media.get('s', {})
+        # Animated items carry gif/mp4 instead of a still image url
+        item_url = source.get('u') or source.get('gif')
+        if source.get('u'):
+            item_url = gallery_variant(media, max_width, max_height) or item_url
+        if item_url:
+            urls.append((item['media_id'], item_url.replace('&amp;', '&')))
+    return urls
+
+def gallery_item(post_data, media_id):
+    # Stand-in post for one gallery item, so state and dedup track items separately
+    parent = post_data.get('crosspost_parent')
+    return {
+        'name': f"{post_id(post_data)}:{media_id}",
+        'crosspost_parent': f"{parent}:{media_id}" if parent else None,
+    }
+
+def image_items(post_data, max_width=None, max_height=None):
+    # What to download for a post as [(item_post_data, url)]: every item of a
+    # gallery, or the post's own image, downscaled to the size limits where
+    # the listing has a smaller copy
+    gallery = find_gallery_urls(post_data, max_width, max_height)
+    if gallery:
+        return [(gallery_item(post_data, media_id), item_url) for media_id, item_url in gallery]
+    img_url = find_image_url(post_data)
+    if not img_url:
+        return []
+    return [(post_data, preview_variant(post_data, max_width, max_height) or img_url)]
+
+def download_image(slot, img_url, session, output_dir, base_index=0, state=None, post_data=None, max_bytes=None,
+                   dedup=None, dedup_store=None, rendition=None):
+    # rendition is set for scrapes with size limits (see variants.rendition_key),
+    # so their copies are deduplicated apart from full-size ones
+    post_data = post_data or {}
+    ext = os.path.splitext(urlparse(img_url).path)[1] or '.jpg'
+    index = base_index + slot
+    filename = f"image_{index}{ext}"
+    filepath = os.path.join(output_dir, filename)
+    if dedup:
+        saved = fetch_deduplicated(dedup_store, img_url, filepath, session, mode=dedup, max_bytes=max_bytes,
+                                   post_ids=(post_id(post_data), post_data.get('crosspost_parent')),
+                                   rendition=rendition)
+        if not saved:
+            # Remember the skipped repost so later runs don't look at it again
+            if state:
+                state.mark_seen(post_id(post_data), 'image')
+            emit(POST_SKIPPED, post_id=post_id(post_data), reason='duplicate')
+            return False
+    else:
+        download_file(img_url, filepath, session, max_bytes=max_bytes)
+    if state:
+        state.record(post_id(post_data), 'image', index, filename)
+    log(f"Downloaded: {filename}")
+    return True
+
+@observable
+def scrape_subreddit_images(subreddit_name, sort_type="hot", output_dir="reddit_images", limit=50,
+                            max_workers=8, per_host_limit=4, lookahead=2, incremental=True, max_bytes=None,
+                            dedup='link', dedup_store=None, session=None, executor=None, max_width=None,
+                            max_height=None):
+    # max_width / max_height pick the largest copy within those bounds from
+    # the listing's preview resolutions instead of the original
+    if limit <= 0:
+        emit(SCRAPE_FINISHED, "Total images downloaded: 0", subreddit=subreddit_name, media='images', count=0)
+        return 0
     url = f"https://www.reddit.com/r/{subreddit_name}/{sort_type}.json"
-    headers = {'User-Agent': 'Mozilla/5.0'}
+    session = session or get_session()
     os.makedirs(output_dir, exist_ok=True)
-    count = 0
-    after = None
-    while count < limit:
-        params = {'limit': 100}
-        if after:
-            params['after'] = after
-        response = requests.get(url, headers=headers, params=params)
-        if response.status_code != 200:
-            print(f"Failed to fetch page: {response.status_code}")
-            break
-        data = response.json()
-        posts = data.get('data', {}).get('children', [])
-        if not posts:
-            break
-        for post in posts:
-            post_data = post.get('data', {})
-            # Check for direct image links or Reddit-hosted images
-            img_url = None
-            if post_data.get('post_hint') == 'image' and 'url' in post_data:
-                img_url = post_data['url']
-            elif 'preview' in post_data and 'images' in post_data['preview']:
-                img_url = post_data['preview']['images'][0]['source']['url']
-                img_url = img_url.replace('&amp;', '&')
-            if img_url and re.search(r'\.(jpg|jpeg|png|webp)$', img_url, re.IGNORECASE):
-                try:
-                    img_data = requests.get(img_url, headers=headers).content
-                    ext = os.path.splitext(img_url)[1].split('?')[0]
-                    filename = f"image_{count}{ext}"
-                    filepath = os.path.join(output_dir, filename)
-                    with open(filepath, 'wb') as f:
-                        f.write(img_data)
-                    print(f"Downloaded: {filename}")
-                    count += 1
-                    if count >= limit:
-                        break
-                except Exception as e:
-                    print(f"Failed to download {img_url}: {e}")
-        after = data.get('data', {}).get('after')
-        if not after:
-            break
-    print(f"Total images downloaded: {count}")
+    # Media already saved by any earlier run is linked or skipped instead of refetched
+    if dedup:
+        dedup_store = dedup_store or get_dedup_store()
+    
+    run = IncrementalScrape(output_dir, subreddit_name, sort_type, incremental)
+    state = run.state
+    base_index = run.next_index('image')
+    
+    def is_candidate(post_data):
+        return any(run.is_new(item, 'image') for item, _ in image_items(post_data))
+    
+    with DownloadPool(limit, max_workers=max_workers, per_host_limit=per_host_limit, executor=executor) as pool, \
+            ListingPrefetcher(url, session, lookahead=lookahead, is_candidate=is_candidate, remaining=limit,
+                              after=run.resume_after, on_page=run.save_cursor) as listing:
+        for post_data in listing:
+            items = image_items(post_data, max_width, max_height)
+            if not items:
+                continue
+            new_items = [(item, item_url) for item, item_url in items if run.is_new(item, 'image')]
+            if not new_items:
+                emit(POST_SKIPPED, post_id=post_id(post_data), reason='seen')
+                if run.stop_at_known():
+                    break
+                continue
+            # Each gallery item takes its own slot and counts against `limit`,
+            # so the items of a gallery download side by side
+            for item, item_url in new_items:
+                pool.submit(item_url, download_image, item_url, session, output_dir, base_index, state, item,
+                            max_bytes, dedup, dedup_store, rendition_key(max_width, max_height))
+                # Block while `limit` downloads are in flight
+                if not pool.wait_for_slot():
+                    break
+            if pool.completed >= pool.limit:
+                break
+            # Let the listing thread know how many more candidates are still wanted
+            listing.set_remaining(pool.remaining())
+        count = pool.drain()
+    
+    run.finish(listing.failed)
+    emit(SCRAPE_FINISHED, f"Total images downloaded: {count}", subreddit=subreddit_name, media='images',
+         count=count)
+    return count
 
 if __name__ == "__main__":
     subreddit = input("Enter subreddit: ")
@@ -1,53 +1,151 @@
-import requests
 import os
-import re
+import requests
+from listing import ListingPrefetcher
+from http_session import get_session
+from scrape_state import IncrementalScrape, post_id
+from downloader import download_file, DownloadError, DownloadTooLarge
+from dedup_store import fetch_deduplicated, get_dedup_store, file_digest
+from dash import download_dash_video, ManifestError, AUDIO_SUFFIX
+from events import log, emit, observable, POST_SKIPPED, SCRAPE_FINISHED
+from variants import pick_video_variant, rendition_key
+from url_classifier import classify_url, VIDEO
+
+def find_video_url(post_data):
+    video_url = None
+    # Reddit-hosted video
+    if post_data.get('is_video') and 'media' in post_data and post_data['media'] and 'reddit_video' in post_data['media']:
+        video_url = post_data['media']['reddit_video'].get('fallback_url')
+    # Animated GIFs and clips (hosted on Reddit or external, imgur .gifv
+    # included); Redgifs links go through third_party_gif
+    elif 'url' in post_data:
+        video_url = post_data['url']
+    match = classify_url(video_url)
+    return match.url if match and match.kind == VIDEO else None
+
+def find_dash_url(post_data):
+    # Manifest of a v.redd.it video that has a sound track, or None
+    reddit_video = (post_data.get('media') or {}).get('reddit_video') or {}
+    if not post_data.get('is_video') or reddit_video.get('is_gif') or reddit_video.get('has_audio') is False:
+        return None
+    return reddit_video.get('dash_url')
+
+def download_video(slot, video_url, session, output_dir, base_index=0, state=None, post_data=None, max_bytes=None,
+                   dedup=None, dedup_store=None, audio=False, max_height=None):
+    # With `audio`, Reddit-hosted videos are fetched from their DASH manifest
+    # with the sound track (see dash.py); video_url is then only the fallback
+    post_data = post_data or {}
+    ext = os.path.splitext(video_url)[1].split('?')[0]
+    index = base_index + slot
+    filename = f"video_{index}{ext}"
+    filepath = os.path.join(output_dir, filename)
+    
+    def fetch(url, download=None, rendition=None):
+        if dedup:
+            return fetch_deduplicated(dedup_store, url, filepath, session, mode=dedup, max_bytes=max_bytes,
+                                      post_ids=(post_id(post_data), post_data.get('crosspost_parent')),
+                                      download=download, sidecars=(AUDIO_SUFFIX,) if download else (),
+                                      rendition=rendition)
+        if download:
+            download(filepath)
+        else:
+            download_file(url, filepath, session, max_bytes=max_bytes)
+        return filepath
+    
+    def download_with_audio(path):
+        sidecars.append(download_dash_video(dash_url, path, session, max_height, max_bytes))
+        return file_digest(path)
+    
+    original_url = find_video_url(post_data)
+    # A smaller rendition than the listing's own is deduplicated apart from it
+    # (the manifest URL is the same for every size)
+    rendition = rendition_key(max_height=max_height) if original_url and video_url != original_url else None
+    dash_url = find_dash_url(post_data) if audio else None
+    sidecars = []
+    fetched = False
+    if dash_url:
+        try:
+            saved = fetch(dash_url, download_with_audio, rendition)
+            fetched = True
+        except DownloadTooLarge:
+            raise
+        except (DownloadError, ManifestError, requests.exceptions.RequestException) as e:
+            log(f"Couldn't fetch {filename} with audio ({e}), downloading the video alone", level='warning')
+    
+    if not fetched:
+        try:
+            saved = fetch(video_url, rendition=rendition)
+        except DownloadTooLarge:
+            raise
+        except DownloadError as e:
+            # A smaller rendition picked by max_height that doesn't exist; fall back to the listing's own
+            if not original_url or original_url == video_url:
+                raise
+            log(f"{video_url} unavailable ({e}), downloading {original_url}", level='warning')
+            saved = fetch(original_url)
+    if not saved:
+        for sidecar in sidecars:
+            if sidecar and os.path.exists(sidecar):
+                os.remove(sidecar)
+        # Remember the skipped repost so later runs don't look at it again
+        if state:
+            state.mark_seen(post_id(post_data), 'video')
+        emit(POST_SKIPPED, post_id=post_id(post_data), reason='duplicate')
+        return False
+    if state:
+        state.record(post_id(post_data), 'video', index, filename)
+    log(f"Downloaded: {filename}")
+    return True
 
-def scrape_subreddit_videos(subreddit_name, sort_type="new", output_dir="reddit_videos", limit=50):
+@observable
+def scrape_subreddit_videos(subreddit_name, sort_type="new", output_dir="reddit_videos", limit=50, lookahead=2,
+                            incremental=True, max_bytes=None, dedup='link', dedup_store=None, session=None,
+                            max_height=None, audio=True):
+    # max_height (e.g. 480) downloads that rendition of taller v.redd.it
+    # videos; audio fetches them with their sound track
+    if limit <= 0:
+        emit(SCRAPE_FINISHED, "Total videos/gifs downloaded: 0", subreddit=subreddit_name, media='videos', count=0)
+        return 0
     url = f"https://www.reddit.com/r/{subreddit_name}/{sort_type}.json"
-    headers = {'User-Agent': 'Mozilla/5.0'}
+    session = session or get_session()
     os.makedirs(output_dir, exist_ok=True)
+    # Media already saved by any earlier run is linked or skipped instead of refetched
+    if dedup:
+        dedup_store = dedup_store or get_dedup_store()
+    
+    run = IncrementalScrape(output_dir, subreddit_name, sort_type, incremental)
+    state = run.state
+    base_index = run.next_index('video')
+    
+    def is_candidate(post_data):
+        return find_video_url(post_data) is not None and run.is_new(post_data, 'video')
+    
     count = 0
-    after = None
-    while count < limit:
-        params = {'limit': 100}
-        if after:
-            params['after'] = after
-        response = requests.get(url, headers=headers, params=params)
-        if response.status_code != 200:
-            print(f"Failed to fetch page: {response.status_code}")
-            break
-        data = response.json()
-        posts = data.get('data', {}).get('children', [])
-        if not posts:
-            break
-        for post in posts:
-            post_data = post.get('data', {})
-            video_url = None
-            # Reddit-hosted video
-            if post_data.get('is_video') and 'media' in post_data and post_data['media'] and 'reddit_video' in post_data['media']:
-                video_url = post_data['media']['reddit_video'].get('fallback_url')
-            # Animated GIFs (hosted on Reddit or external)
-            elif 'url' in post_data and re.search(r'\.(gif|mp4|webm)$', post_data['url'], re.IGNORECASE):
-                video_url = post_data['url']
-            # Gfycat or Redgifs links (optional, can be expanded)
-            if video_url and re.search(r'\.(mp4|webm|gif)$', video_url, re.IGNORECASE):
-                try:
-                    vid_data = requests.get(video_url, headers=headers).content
-                    ext = os.path.splitext(video_url)[1].split('?')[0]
-                    filename = f"video_{count}{ext}"
-                    filepath = os.path.join(output_dir, filename)
-                    with open(filepath, 'wb') as f:
-                        f.write(vid_data)
-                    print(f"Downloaded: {filename}")
+    with ListingPrefetcher(url, session, lookahead=lookahead, is_candidate=is_candidate, remaining=limit,
+                           after=run.resume_after, on_page=run.save_cursor) as listing:
+        for post_data in listing:
+            video_url = find_video_url(post_data)
+            if not video_url:
+                continue
+            if not run.is_new(post_data, 'video'):
+                emit(POST_SKIPPED, post_id=post_id(post_data), reason='seen')
+                if run.stop_at_known():
+                    break
+                continue
+            video_url = pick_video_variant(video_url, max_height) or video_url
+            try:
+                if download_video(count, video_url, session, output_dir, base_index, state, post_data, max_bytes,
+                                  dedup, dedup_store, audio, max_height):
                     count += 1
                     if count >= limit:
                         break
-                except Exception as e:
-                    print(f"Failed to download {video_url}: {e}")
-        after = data.get('data', {}).get('after')
-        if not after:
-            break
-    print(f"Total videos/gifs downloaded: {count}")
+            except Exception as e:
+                log(f"Failed to download {video_url}: {e}", level='error')
+            listing.set_remaining(limit - count)
+    
+    run.finish(listing.failed)
+    emit(SCRAPE_FINISHED, f"Total videos/gifs downloaded: {count}", subreddit=subreddit_name, media='videos',
+         count=count)
+    return count
 
 if __name__ == "__main__":
     subreddit = input("Enter subreddit: ")
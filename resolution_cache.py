@@ -0,0 +1,119 @@
+import os
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+from sqlite_store import SQLiteStore, data_dir
+
+# Resolved media URLs are reused for this long unless the URL says it expires sooner
+POSITIVE_TTL = 24 * 3600
+# Ids that could not be resolved are retried after this long
+NEGATIVE_TTL = 6 * 3600
+MAX_ENTRIES = 100000
+# Treat signed URLs as expired this many seconds early
+EXPIRY_MARGIN = 300
+
+
+def _url_expiry(video_url):
+    # Signed CDN URLs carry their own deadline, e.g. ...mp4?expires=1700000000&signature=...
+    query = parse_qs(urlparse(video_url).query)
+    for key in ('expires', 'Expires', 'exp'):
+        if key in query:
+            try:
+                return float(query[key][0]) - EXPIRY_MARGIN
+            except ValueError:
+                pass
+    return None
+
+
+class ResolutionCache(SQLiteStore):
+    # Maps a third-party media key (e.g. "redgifs:<id>") to the resolved video
+    # URL, or to NULL when resolution failed, with per-entry expiry and
+    # least-recently-used eviction once max_entries is exceeded
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS resolutions (
+            key TEXT PRIMARY KEY,
+            video_url TEXT,
+            expires_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS resolutions_accessed ON resolutions (accessed_at);
+    """
+
+    def __init__(self, path=None, ttl=POSITIVE_TTL, negative_ttl=NEGATIVE_TTL, max_entries=MAX_ENTRIES):
+        super().__init__(path or os.path.join(data_dir(), "resolution_cache.sqlite3"))
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+
+    def get_many(self, keys):
+        # Returns {key: video_url or None} for every unexpired entry
+        keys = list(dict.fromkeys(keys))
+        if not keys:
+            return {}
+        now = time.time()
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, video_url FROM resolutions WHERE key IN ({placeholders}) AND expires_at > ?",
+                    chunk + [now]).fetchall()
+                found.update(rows)
+            if found:
+                with self._conn:
+                    self._conn.executemany("UPDATE resolutions SET accessed_at = ? WHERE key = ?",
+                                           [(now, key) for key in found])
+        return found
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def put_many(self, items):
+        now = time.time()
+        rows = []
+        for key, video_url in items.items():
+            if video_url:
+                expires_at = now + self.ttl
+                url_expiry = _url_expiry(video_url)
+                if url_expiry is not None:
+                    expires_at = min(expires_at, url_expiry)
+            else:
+                expires_at = now + self.negative_ttl
+            rows.append((key, video_url, expires_at, now))
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO resolutions (key, video_url, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                rows)
+            self._evict()
+
+    def put(self, key, video_url):
+        self.put_many({key: video_url})
+
+    def _evict(self):
+        now = time.time()
+        self._conn.execute("DELETE FROM resolutions WHERE expires_at <= ?", (now,))
+        excess = self._conn.execute("SELECT COUNT(*) FROM resolutions").fetchone()[0] - self.max_entries
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM resolutions WHERE key IN "
+                "(SELECT key FROM resolutions ORDER BY accessed_at LIMIT ?)", (excess,))
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM resolutions")
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_resolution_cache():
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResolutionCache()
+        return _default_cache
@@ -0,0 +1,126 @@
+import os
+import time
+from sqlite_store import SQLiteStore
+from events import log
+
+STATE_FILENAME = ".screddit_state.sqlite3"
+
+
+def post_id(post_data):
+    # Listing children carry both the fullname (t3_abc123) and the bare id
+    return post_data.get('name') or post_data.get('id')
+
+
+class ScrapeState(SQLiteStore):
+    # Remembers, per output folder, which posts were already downloaded, the
+    # next free file index for each kind of media and the listing cursor of an
+    # unfinished run so it can be resumed
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS posts (
+            post_id TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            filename TEXT,
+            fetched_at REAL NOT NULL,
+            PRIMARY KEY (post_id, kind)
+        );
+        CREATE TABLE IF NOT EXISTS file_indexes (
+            kind TEXT PRIMARY KEY,
+            next_index INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS cursors (
+            listing TEXT PRIMARY KEY,
+            after TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, output_dir):
+        super().__init__(os.path.join(output_dir, STATE_FILENAME))
+
+    def is_seen(self, post_id, kind):
+        if not post_id:
+            return False
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM posts WHERE post_id = ? AND kind = ?", (post_id, kind)).fetchone()
+        return row is not None
+
+    def next_index(self, kind):
+        with self._lock:
+            row = self._conn.execute("SELECT next_index FROM file_indexes WHERE kind = ?", (kind,)).fetchone()
+        return row[0] if row else 0
+
+    def mark_seen(self, post_id, kind, filename=None):
+        if not post_id:
+            return
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO posts (post_id, kind, filename, fetched_at) VALUES (?, ?, ?, ?)",
+                (post_id, kind, filename, time.time()))
+
+    def record(self, post_id, kind, index, filename):
+        self.mark_seen(post_id, kind, filename)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO file_indexes (kind, next_index) VALUES (?, ?) "
+                "ON CONFLICT(kind) DO UPDATE SET next_index = MAX(next_index, excluded.next_index)",
+                (kind, index + 1))
+
+    def resume_cursor(self, listing):
+        with self._lock:
+            row = self._conn.execute("SELECT after FROM cursors WHERE listing = ?", (listing,)).fetchone()
+        return row[0] if row else None
+
+    def save_cursor(self, listing, after):
+        with self._lock, self._conn:
+            if after:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO cursors (listing, after, updated_at) VALUES (?, ?, ?)",
+                    (listing, after, time.time()))
+            else:
+                self._conn.execute("DELETE FROM cursors WHERE listing = ?", (listing,))
+
+    def clear_cursor(self, listing):
+        self.save_cursor(listing, None)
+
+
+class IncrementalScrape:
+    # The incremental side of one scrape of a listing into output_dir: posts
+    # earlier runs downloaded there are skipped, file numbering continues
+    # where they left off and an interrupted run resumes from its last
+    # listing page. With incremental off `state` is None and nothing is
+    # skipped, resumed or remembered.
+
+    def __init__(self, output_dir, subreddit_name, sort_type, incremental=True, listing=None):
+        # listing names the cursor when one folder holds several crawls of the same listing
+        self.state = ScrapeState(output_dir) if incremental else None
+        self.sort_type = sort_type
+        self.listing_key = f"{subreddit_name}/{sort_type}" + (f"/{listing}" if listing else "")
+        self.resume_after = self.state.resume_cursor(self.listing_key) if self.state else None
+        if self.resume_after:
+            log(f"Resuming r/{subreddit_name} ({sort_type}) from {self.resume_after}")
+
+    def next_index(self, kind):
+        return self.state.next_index(kind) if self.state else 0
+
+    def is_new(self, post_data, kind):
+        return not (self.state and self.state.is_seen(post_id(post_data), kind))
+
+    def stop_at_known(self):
+        # For a post an earlier run already saved: `new` is newest-first, so
+        # the first known post means the rest are known too
+        if self.sort_type == "new" and not self.resume_after:
+            log("Reached previously downloaded posts")
+            return True
+        return False
+
+    def save_cursor(self, cursor):
+        if self.state:
+            self.state.save_cursor(self.listing_key, cursor)
+
+    def finish(self, failed=False):
+        # Keeps the cursor when the listing broke off so the next run picks up there
+        if self.state:
+            if not failed:
+                self.state.clear_cursor(self.listing_key)
+            self.state.close()
@@ -0,0 +1,36 @@
+import os
+import sqlite3
+import threading
+
+
+def data_dir():
+    # Shared location for caches and indexes that outlive a single output folder
+    return os.environ.get('SCREDDIT_DATA_DIR') or os.path.join(os.path.expanduser("~"), ".screddit")
+
+
+class SQLiteStore:
+    # Small base for the on-disk stores: one connection shared by every thread,
+    # with writes serialized through a lock
+
+    schema = ""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript(self.schema)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -2,90 +2,123 @@ import requests
 import os
 import re
 import json
-import urllib3
+import base64
+import threading
+import time
 from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from listing import ListingPrefetcher
+from http_session import get_session, HTML_HEADERS, REDGIFS_API_HEADERS, VIDEO_HEADERS
+from resolution_cache import get_resolution_cache
+from scrape_state import IncrementalScrape, post_id
+from downloader import open_stream, download_file, content_length, DownloadError, DownloadTooLarge
+from events import log, emit, observable, propagate, POST_SKIPPED, SCRAPE_FINISHED
+from metrics import timed, count
+from url_classifier import classify_url, find_redgifs_link, REDGIF
 
-# Suppress insecure request warnings when we disable SSL verification as a last resort
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+REDGIFS_API_URL = "https://api.redgifs.com/v2"
+# Ids resolved per request to the gifs endpoint
+REDGIFS_BATCH_SIZE = 50
+# Timeout for each HEAD probe against the thumbs CDN
+PROBE_TIMEOUT = 5
 
-def extract_gif_url(url):
-    video_id = None
-    
-    # Extract the ID from various redgif URL formats
-    if "redgifs.com" in url or "gifdeliverynetwork.com" in url:
-        path = urlparse(url).path
-        # Extract ID from paths like /watch/SomethingHere or /SomethingHere or /ifr/SomethingHere
-        match = re.search(r'/watch/([^/]+)$|/([^/]+)$|/ifr/([^/]+)$', path)
-        if match:
-            video_id = match.group(1) or match.group(2) or match.group(3)
-            print(f"Extracted video ID: {video_id}")
-    
-    if not video_id:
-        print(f"Failed to extract video ID from: {url}")
+def extract_gif_id(url):
+    # Extract the ID from the various Redgifs / gifdeliverynetwork URL
+    # formats (see url_classifier.py)
+    match = classify_url(url)
+    return match.media_id if match and match.kind == REDGIF else None
+
+def _pick_video_url(gif_data):
+    # Extract the HD URL if available, otherwise use the SD URL
+    urls = gif_data.get('urls', {})
+    return urls.get('hd') or urls.get('sd') or urls.get('mp4') or urls.get('mobile')
+
+def _get_with_token(session, api_url, params=None):
+    token = get_cached_gifs_token(session)
+    if not token:
+        log("Failed to get authentication token for Redgifs API", level='error')
         return None
     
-    # First, get authentication token
-    token = get_gifs_token()
-    if not token:
-        print("Failed to get authentication token for Redgifs API")
-        # Try alternative direct methods
-    else:
-        print(f"Successfully obtained Redgifs auth token")
-        
-        # Get API information for the video
-        api_url = f"https://api.redgifs.com/v2/gifs/{video_id}"
-        print(f"Requesting API URL: {api_url}")
-        
-        # Modern user agent and additional headers required by Redgifs API
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
-            'Referer': 'https://www.redgifs.com/',
-            'Accept': 'application/json',
-            'Origin': 'https://www.redgifs.com',
-            'Authorization': f'Bearer {token}'
-        }
-        
-        try:
-            response = requests.get(api_url, headers=headers)
-            print(f"API response status: {response.status_code}")
-            
-            if response.status_code == 200:
-                data = response.json()
-                # Extract the HD URL if available, otherwise use the SD URL
-                gif_data = data.get('gif', {})
-                urls = gif_data.get('urls', {})
-                
-                # Try different URL formats that might be available
-                video_url = urls.get('hd') or urls.get('sd') or urls.get('mp4') or urls.get('mobile')
-                
-                if video_url:
-                    print(f"Successfully extracted video URL: {video_url}")
-                    return video_url
-                else:
-                    print(f"No video URL found in API response. Available keys: {urls.keys() if urls else 'No URLs found'}")
-            else:
-                print(f"API request failed with status {response.status_code}")
-                # Try to print the error response
-                try:
-                    print(f"Error response: {response.text[:200]}")
-                except:
-                    pass
-                    
-        except Exception as e:
-            print(f"Error extracting Redgif URL: {e}")
+    # Additional headers required by Redgifs API
+    headers = dict(REDGIFS_API_HEADERS, Authorization=f'Bearer {token}')
+    response = session.get(api_url, headers=headers, params=params)
     
-    # If the API method failed, try alternative methods
+    if response.status_code == 401:
+        # The cached token expired early or was revoked, re-authenticate once
+        log("Redgifs token rejected, refreshing it", level='warning')
+        token = get_cached_gifs_token(session, stale_token=token)
+        if token:
+            headers = dict(REDGIFS_API_HEADERS, Authorization=f'Bearer {token}')
+            response = session.get(api_url, headers=headers, params=params)
+    return response
+
+@timed('redgifs_api')
+def _fetch_gif_from_api(video_id, session):
+    # Returns (answered, video_url); answered is False when the API couldn't be asked
+    api_url = f"{REDGIFS_API_URL}/gifs/{video_id}"
+    log(f"Requesting API URL: {api_url}")
+    try:
+        response = _get_with_token(session, api_url)
+        if response is None:
+            return False, None
+        log(f"API response status: {response.status_code}")
+        
+        if response.status_code == 200:
+            gif_data = response.json().get('gif', {})
+            urls = gif_data.get('urls', {})
+            video_url = _pick_video_url(gif_data)
+            if video_url:
+                return True, video_url
+            log(f"No video URL found in API response. Available keys: {urls.keys() if urls else 'No URLs found'}")
+            return True, None
+        elif response.status_code in (404, 410):
+            log(f"API request failed with status {response.status_code}", level='error')
+            return True, None
+        else:
+            log(f"API request failed with status {response.status_code}", level='error')
+            # Try to print the error response
+            try:
+                log(f"Error response: {response.text[:200]}", level='error')
+            except Exception:
+                pass
+    except Exception as e:
+        log(f"Error extracting Redgif URL: {e}", level='error')
+    return False, None
+
+@timed('redgifs_api_batch')
+def _fetch_gifs_from_api(video_ids, session):
+    # The gifs endpoint accepts a comma separated `ids` list and answers with
+    # every gif it knows about; ids come back lowercased. Ids the API answered
+    # for without a usable URL map to None.
+    resolved = {}
+    try:
+        response = _get_with_token(session, f"{REDGIFS_API_URL}/gifs", params={'ids': ','.join(video_ids)})
+        if response is None:
+            return resolved
+        log(f"Batch API response status: {response.status_code} for {len(video_ids)} ids")
+        if response.status_code == 200:
+            resolved = dict.fromkeys((video_id.lower() for video_id in video_ids), None)
+            for gif_data in response.json().get('gifs', []):
+                video_url = _pick_video_url(gif_data)
+                if gif_data.get('id') and video_url:
+                    resolved[gif_data['id'].lower()] = video_url
+            return resolved
+    except Exception as e:
+        log(f"Error resolving Redgif batch: {e}", level='error')
     
+    # Batch lookup isn't available, fall back to one request per id
+    for video_id in video_ids:
+        answered, video_url = _fetch_gif_from_api(video_id, session)
+        if answered:
+            resolved[video_id.lower()] = video_url
+    return resolved
+
+@timed('redgifs_page')
+def _scrape_gif_page(url, session):
     # Try to scrape the webpage directly
     try:
-        print(f"Trying to scrape the webpage: {url}")
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml',
-            'Accept-Language': 'en-US,en;q=0.9',
-        }
-        
-        response = requests.get(url, headers=headers)
+        log(f"Trying to scrape the webpage: {url}")
+        response = session.get(url, headers=HTML_HEADERS)
         
         if response.status_code == 200:
             html_content = response.text
@@ -102,16 +135,27 @@ def extract_gif_url(url):
             for pattern in video_patterns:
                 matches = re.findall(pattern, html_content)
                 if matches:
-                    print(f"Found video URL in HTML: {matches[0]}")
+                    log(f"Found video URL in HTML: {matches[0]}")
                     return matches[0]
                     
-            print("No video URL found in HTML content")
+            log("No video URL found in HTML content")
         else:
-            print(f"Failed to fetch webpage, status code: {response.status_code}")
+            log(f"Failed to fetch webpage, status code: {response.status_code}", level='error')
             
     except Exception as e:
-        print(f"Error scraping webpage: {e}")
-    
+        log(f"Error scraping webpage: {e}", level='error')
+    return None
+
+@timed('redgifs_probe')
+def _probe_direct_url(direct_url, session):
+    try:
+        head_resp = session.head(direct_url, timeout=PROBE_TIMEOUT)
+        return head_resp.status_code == 200
+    except Exception as e:
+        log(f"Error checking direct URL {direct_url}: {e}", level='error')
+        return False
+
+def _probe_direct_urls(video_id, session):
     # Try several potential direct URL formats
     direct_url_formats = [
         f"https://thumbs.redgifs.com/{video_id}.mp4",
@@ -123,31 +167,167 @@ def extract_gif_url(url):
         f"https://thumbs.redgifs.com/{video_id}-mobile.mp4"
     ]
     
-    for direct_url in direct_url_formats:
+    # All probes run at once, so an unresolvable id costs one timeout rather
+    # than one per candidate; the earliest format in the list wins
+    log(f"Probing {len(direct_url_formats)} direct URLs for {video_id}")
+    with ThreadPoolExecutor(max_workers=len(direct_url_formats)) as executor:
+        futures = [executor.submit(propagate(_probe_direct_url), direct_url, session) for direct_url in direct_url_formats]
+        results = [future.result() for future in futures]
+    for direct_url, ok in zip(direct_url_formats, results):
+        if ok:
+            log(f"Direct URL worked: {direct_url}")
+            return direct_url
+    return None
+
+def _resolve_without_api(url, video_id, session):
+    # If the API method failed, try alternative methods
+    return _scrape_gif_page(url, session) or _probe_direct_urls(video_id, session)
+
+def _cache_key(video_id):
+    return f"redgifs:{video_id.lower()}"
+
+def _open_cache(cache):
+    # cache=None uses the shared on-disk cache, cache=False disables caching
+    if cache is False:
+        return None
+    if cache is None:
         try:
-            print(f"Trying direct URL: {direct_url}")
-            head_resp = requests.head(direct_url, timeout=5, headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36'
-            })
-            if head_resp.status_code == 200:
-                print(f"Direct URL worked: {direct_url}")
-                return direct_url
+            return get_resolution_cache()
         except Exception as e:
-            print(f"Error checking direct URL {direct_url}: {e}")
+            log(f"Resolution cache unavailable: {e}", level='warning')
+            return None
+    return cache
+
+@timed('redgifs_resolve')
+def resolve_gif_urls(urls, session=None, batch_size=REDGIFS_BATCH_SIZE, fallback_workers=4, cache=None):
+    # Resolves many Redgifs page URLs at once: cached ids are answered from
+    # disk, the rest are looked up in batches through the API and the
+    # leftovers go through the HTML/probe fallbacks concurrently.
+    # Returns {url: video_url or None}.
+    session = session or get_session()
+    cache = _open_cache(cache)
+    results = {}
+    ids = {}
+    for url in urls:
+        video_id = extract_gif_id(url)
+        if video_id:
+            log(f"Extracted video ID: {video_id}")
+            ids[url] = video_id
+        else:
+            log(f"Failed to extract video ID from: {url}", level='error')
+            results[url] = None
     
-    return None
+    cached = cache.get_many([_cache_key(video_id) for video_id in ids.values()]) if cache else {}
+    for url, video_id in list(ids.items()):
+        key = _cache_key(video_id)
+        if key in cached:
+            log(f"Using cached resolution for {video_id}")
+            results[url] = cached[key]
+            del ids[url]
+    count('resolution_cache_hits', len(cached))
+    count('resolution_cache_misses', len(set(ids.values())))
+    
+    unique_ids = list(dict.fromkeys(ids.values()))
+    resolved = {}
+    for start in range(0, len(unique_ids), batch_size):
+        resolved.update(_fetch_gifs_from_api(unique_ids[start:start + batch_size], session))
+    
+    to_cache = {}
+    unresolved = []
+    for url, video_id in ids.items():
+        video_url = resolved.get(video_id.lower())
+        if video_url:
+            log(f"Successfully extracted video URL: {video_url}")
+            results[url] = video_url
+            to_cache[_cache_key(video_id)] = video_url
+        else:
+            unresolved.append(url)
+    
+    if unresolved:
+        with ThreadPoolExecutor(max_workers=max(1, fallback_workers)) as executor:
+            futures = [executor.submit(propagate(_resolve_without_api), url, ids[url], session) for url in unresolved]
+            fallbacks = [future.result() for future in futures]
+            for url, video_url in zip(unresolved, fallbacks):
+                results[url] = video_url
+                # Only remember a failure when the API itself said the id has no video,
+                # not when it was merely unreachable
+                if video_url or ids[url].lower() in resolved:
+                    to_cache[_cache_key(ids[url])] = video_url
+    
+    if cache and to_cache:
+        cache.put_many(to_cache)
+    return results
 
-def get_gifs_token():
+def extract_gif_url(url, session=None, cache=None):
+    return resolve_gif_urls([url], session, cache=cache).get(url)
+
+# Refresh a token this many seconds before it expires
+REDGIFS_TOKEN_EXPIRY_MARGIN = 60
+# Lifetime assumed for tokens that don't carry a JWT `exp` claim
+REDGIFS_TOKEN_TTL = 3600
+# How long to wait before retrying after a failed token fetch
+REDGIFS_TOKEN_FAILURE_TTL = 60
+
+def _token_expiry(token):
+    # Redgifs tokens are JWTs; read the `exp` claim without verifying the signature
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+        if exp:
+            return float(exp)
+    except Exception:
+        pass
+    return time.time() + REDGIFS_TOKEN_TTL
+
+class _TokenCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0
+        self._retry_at = 0
+
+    def get(self, session, stale_token=None):
+        # Holding the lock while fetching means concurrent callers wait for a
+        # single refresh instead of each downloading the homepage
+        with self._lock:
+            now = time.time()
+            if stale_token is not None and stale_token == self._token:
+                self._token = None
+            if self._token and now < self._expires_at - REDGIFS_TOKEN_EXPIRY_MARGIN:
+                return self._token
+            if stale_token is None and now < self._retry_at:
+                return None
+            token = get_gifs_token(session)
+            if token:
+                self._token = token
+                self._expires_at = _token_expiry(token)
+            else:
+                self._token = None
+                self._retry_at = now + REDGIFS_TOKEN_FAILURE_TTL
+            return token
+
+    def clear(self):
+        with self._lock:
+            self._token = None
+            self._expires_at = 0
+            self._retry_at = 0
+
+_token_cache = _TokenCache()
+
+def get_cached_gifs_token(session=None, stale_token=None):
+    # Pass the token that was just rejected as stale_token to force a refresh
+    return _token_cache.get(session or get_session(), stale_token)
+
+def clear_gifs_token_cache():
+    _token_cache.clear()
+
+@timed('redgifs_token')
+def get_gifs_token(session=None):
+    session = session or get_session()
     try:
-        # First try to get the temporary token from the main page
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
-            'Accept': 'text/html,application/xhtml+xml,application/xml',
-            'Accept-Language': 'en-US,en;q=0.9',
-        }
-        
         # Get the main page to extract any available tokens or authentication details
-        response = requests.get("https://www.redgifs.com/", headers=headers)
+        response = session.get("https://www.redgifs.com/", headers=HTML_HEADERS)
         
         if response.status_code == 200:
             # Look for the token in the JavaScript code
@@ -167,9 +347,9 @@ def get_gifs_token():
                     return token
         
         # If the above didn't work, try the OAuth endpoint to get a token
-        print("Trying to get temporary OAuth token")
-        oauth_url = "https://api.redgifs.com/v2/auth/temporary"
-        resp = requests.get(oauth_url, headers=headers)
+        log("Trying to get temporary OAuth token")
+        oauth_url = f"{REDGIFS_API_URL}/auth/temporary"
+        resp = session.get(oauth_url, headers=HTML_HEADERS)
         
         if resp.status_code == 200:
             data = resp.json()
@@ -177,181 +357,198 @@ def get_gifs_token():
             if token:
                 return token
                 
-        print(f"Failed to get Redgifs authentication token, status: {response.status_code}")
+        log(f"Failed to get Redgifs authentication token, status: {response.status_code}", level='error')
         return None
         
     except Exception as e:
-        print(f"Error getting Redgifs token: {e}")
+        log(f"Error getting Redgifs token: {e}", level='error')
+        return None
+
+
+
+def find_redgif_url(post_data):
+    post_url = post_data.get('url')
+    if not post_url:
         return None
+    # Check if it's a Redgif link
+    match = classify_url(post_url)
+    if match and match.kind == REDGIF:
+        return match.url
+    # Try to check for embedded Redgif links in selftext
+    return find_redgifs_link(post_data.get('selftext'))
+
+def _print_progress():
+    # Reports roughly every 10% when the size is known, otherwise every MB
+    state = {'next': 0}
+    def progress(downloaded, total):
+        step = max(total // 10, 1) if total > 0 else 1048576
+        if downloaded >= state['next']:
+            if total > 0:
+                log(f"Download progress: {downloaded / total * 100:.1f}%")
+            else:
+                log(f"Downloaded {downloaded/1048576:.1f} MB")
+            state['next'] = (downloaded // step + 1) * step
+    return progress
+
+def _allow_insecure():
+    # Silence urllib3's warning only once we actually fall back to verify=False
+    import urllib3
+    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+def gif_filename(post_data, index, ext):
+    # Create filename with post title if available, otherwise use counter
+    if post_data.get('title'):
+        # Sanitize the title for use in filename
+        safe_title = re.sub(r'[\\/*?:"<>|]', "", post_data['title'])
+        safe_title = safe_title[:50]  # Limit title length
+        return f"{safe_title}_{index}{ext}"
+    return f"video_{index}{ext}"
 
+def download_gif_video(video_url, post_data, output_dir, index, session=None, max_bytes=None, max_retries=3):
+    session = session or get_session()
+    
+    try:
+        log(f"Downloading video from: {video_url}")
+        # Set additional headers for the download request
+        download_headers = dict(VIDEO_HEADERS, Referer=post_data.get('url'))
+        
+        # First try with SSL verification
+        verify_kwargs = {}
+        try:
+            video_response = open_stream(video_url, session, download_headers, timeout=30)
+        except requests.exceptions.SSLError:
+            log("SSL verification failed, trying without verification (not recommended but might work)",
+                level='warning')
+            _allow_insecure()
+            verify_kwargs = {'verify': False}
+            video_response = open_stream(video_url, session, download_headers, timeout=30, **verify_kwargs)
+        
+        # Check if we got content
+        total = content_length(video_response)
+        if total == 0:
+            log("Warning: Content-Length is 0, will try to download anyway", level='warning')
+        
+        log(f"Content length: {total} bytes")
+        
+        # Get file extension from URL or content-type or default to .mp4
+        ext = os.path.splitext(urlparse(video_url).path)[1]
+        if not ext or len(ext) > 5:  # If no extension or suspicious extension
+            content_type = video_response.headers.get('Content-Type', '')
+            if 'video/mp4' in content_type:
+                ext = '.mp4'
+            elif 'video/webm' in content_type:
+                ext = '.webm'
+            else:
+                ext = '.mp4'  # Default
+        
+        filename = gif_filename(post_data, index, ext)
+        filepath = os.path.join(output_dir, filename)
+        
+        # Stream to disk with progress indicator; interrupted attempts resume
+        # from the .part file with a Range request instead of starting over
+        downloaded = download_file(video_url, filepath, session, download_headers, max_bytes=max_bytes,
+                                   progress=_print_progress(), retries=max_retries,
+                                   first_response=video_response, timeout=30, **verify_kwargs)
+        
+        # Verify the download completed successfully
+        if downloaded > 0:
+            log(f"Downloaded: {filename} ({downloaded} bytes)")
+            return filename
+        log("Download appears to have failed: file size is 0", level='error')
+        os.remove(filepath)
+    
+    except DownloadTooLarge as e:
+        log(f"Skipping {video_url}: {e}", level='warning')
+    except DownloadError as e:
+        log(f"Failed to download {video_url}: {e}", level='error')
+    except requests.exceptions.Timeout:
+        log(f"Timeout error downloading {video_url}", level='error')
+    except requests.exceptions.RequestException as e:
+        log(f"Network error downloading {video_url}: {e}", level='error')
+    except Exception as e:
+        log(f"Failed to download {video_url}: {e}", level='error')
+    
+    return None
 
-def scrape_gif_videos(subreddit_name, sort_type="hot", output_dir="redgif_videos", limit=50):
+@observable
+def scrape_gif_videos(subreddit_name, sort_type="hot", output_dir="redgif_videos", limit=50, lookahead=2,
+                      batch_size=REDGIFS_BATCH_SIZE, cache=None, incremental=True, max_bytes=None, session=None):
+    if limit <= 0:
+        emit(SCRAPE_FINISHED, "Total Redgif videos downloaded: 0", subreddit=subreddit_name, media='gifs', count=0)
+        return 0
     url = f"https://www.reddit.com/r/{subreddit_name}/{sort_type}.json"
-    headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36'}
+    session = session or get_session()
     
     os.makedirs(output_dir, exist_ok=True)
     count = 0
-    after = None
+    failed = False
     
-    while count < limit:
-        params = {'limit': 500}
-        if after:
-            params['after'] = after
-        
+    run = IncrementalScrape(output_dir, subreddit_name, sort_type, incremental)
+    state = run.state
+    base_index = run.next_index('redgif')
+    
+    def is_candidate(post_data):
+        return find_redgif_url(post_data) is not None and run.is_new(post_data, 'redgif')
+    
+    # The listing is paged on a background thread while videos download
+    with ListingPrefetcher(url, session, page_size=500, lookahead=lookahead, is_candidate=is_candidate,
+                           remaining=limit, verbose=True, after=run.resume_after, on_page=run.save_cursor) as listing:
         try:
-            print(f"Fetching Reddit page: {url} with params {params}")
-            response = requests.get(url, headers=headers, params=params)
-            if response.status_code != 200:
-                print(f"Failed to fetch page: {response.status_code}")
-                break
-                
-            data = response.json()
-            posts = data.get('data', {}).get('children', [])
-            
-            if not posts:
-                print("No more posts found.")
-                break
-            
-            print(f"Found {len(posts)} posts to process")    
-            for post in posts:
-                post_data = post.get('data', {})
-                permalink = post_data.get('permalink')
-                post_url = post_data.get('url')
-                
-                if not post_url:
-                    continue
+            for posts in listing.pages():
+                candidates = []
+                reached_known = False
+                for post_data in posts:
+                    redgif_url = find_redgif_url(post_data)
+                    if not redgif_url:
+                        continue
+                    if not run.is_new(post_data, 'redgif'):
+                        emit(POST_SKIPPED, post_id=post_id(post_data), reason='seen')
+                        if run.stop_at_known():
+                            reached_known = True
+                            break
+                        continue
+                    candidates.append((post_data, redgif_url))
                 
-                video_url = None
-                  # Check if it's a Redgif link
-                if "redgifs.com" in post_url or "gifdeliverynetwork.com" in post_url:
-                    print(f"Found Redgif link: {post_url}")
-                    video_url = extract_gif_url(post_url)
-                    if not video_url:
-                        print("Failed to extract Redgif video URL")
-                
-                # Try to check for embedded Redgif links in selftext
-                elif 'selftext' in post_data and post_data['selftext']:
-                    selftext = post_data['selftext']
-                    # Look for Redgif links in the text
-                    redgif_match = re.search(r'https?://(?:www\.)?redgifs\.com/\S+', selftext)
-                    
-                    if redgif_match:
-                        redgif_url = redgif_match.group(0)
-                        print(f"Found Redgif link in selftext: {redgif_url}")
-                        video_url = extract_gif_url(redgif_url)
-                
-                if video_url:
-                    max_retries = 3
-                    retry_count = 0
+                # Resolve the page's Redgif ids in batches, never more than the limit can still use
+                while candidates and count < limit:
+                    batch = candidates[:min(batch_size, limit - count)]
+                    candidates = candidates[len(batch):]
+                    for _, redgif_url in batch:
+                        log(f"Found Redgif link: {redgif_url}")
+                    resolved = resolve_gif_urls([redgif_url for _, redgif_url in batch], session, batch_size, cache=cache)
                     
-                    while retry_count < max_retries:
-                        try:
-                            print(f"Downloading video from: {video_url} (Attempt {retry_count + 1}/{max_retries})")
-                            # Set additional headers for the download request
-                            download_headers = {
-                                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36',
-                                'Referer': post_url,
-                                'Accept': 'video/webm,video/mp4,video/*;q=0.9,*/*;q=0.8',
-                                'Accept-Encoding': 'gzip, deflate, br',
-                                'Connection': 'keep-alive',
-                                'Range': 'bytes=0-'  # Request the full file
-                            }
-                            
-                            # First try with SSL verification
-                            try:
-                                video_response = requests.get(video_url, headers=download_headers, stream=True, timeout=30)
-                            except requests.exceptions.SSLError:
-                                print("SSL verification failed, trying without verification (not recommended but might work)")
-                                video_response = requests.get(video_url, headers=download_headers, stream=True, timeout=30, verify=False)
-                            
-                            # Check if the response was successful
-                            if video_response.status_code not in [200, 206]:  # 200 OK or 206 Partial Content
-                                print(f"Failed to download, status code: {video_response.status_code}")
-                                print(f"Response headers: {video_response.headers}")
-                                retry_count += 1
-                                continue
-                                
-                            # Check if we got content
-                            content_length = int(video_response.headers.get('Content-Length', 0))
-                            if content_length == 0:
-                                print("Warning: Content-Length is 0, will try to download anyway")
-                                
-                            print(f"Content length: {content_length} bytes")
-                            
-                            # Get file extension from URL or content-type or default to .mp4
-                            ext = os.path.splitext(video_url)[1]
-                            if not ext or len(ext) > 5:  # If no extension or suspicious extension
-                                content_type = video_response.headers.get('Content-Type', '')
-                                if 'video/mp4' in content_type:
-                                    ext = '.mp4'
-                                elif 'video/webm' in content_type:
-                                    ext = '.webm'
-                                else:
-                                    ext = '.mp4'  # Default
-                            
-                            # Remove query parameters from extension
-                            ext = ext.split('?')[0]
-                                
-                            # Create filename with post title if available, otherwise use counter
-                            if post_data.get('title'):
-                                # Sanitize the title for use in filename
-                                safe_title = re.sub(r'[\\/*?:"<>|]', "", post_data['title'])
-                                safe_title = safe_title[:50]  # Limit title length
-                                filename = f"{safe_title}_{count}{ext}"
-                            else:
-                                filename = f"video_{count}{ext}"
-                                
-                            filepath = os.path.join(output_dir, filename)
-                            
-                            # Download with progress indicator
-                            downloaded = 0
-                            with open(filepath, 'wb') as f:
-                                for chunk in video_response.iter_content(chunk_size=8192):
-                                    if chunk:
-                                        f.write(chunk)
-                                        downloaded += len(chunk)
-                                        # Show progress every ~10%
-                                        if content_length > 0 and downloaded % (max(content_length // 10, 1)) < 8192:
-                                            percent = (downloaded / content_length) * 100
-                                            print(f"Download progress: {percent:.1f}%")
-                                        elif downloaded % 1048576 == 0:  # Show progress every 1MB if content_length is unknown
-                                            print(f"Downloaded {downloaded/1048576:.1f} MB")
-                            
-                            # Verify the download completed successfully
-                            if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-                                print(f"Downloaded: {filename} ({os.path.getsize(filepath)} bytes)")
-                                count += 1
-                                break  # Success, exit retry loop
-                            else:
-                                print(f"Download appears to have failed: file size is {os.path.getsize(filepath) if os.path.exists(filepath) else 'file not found'}")
-                                retry_count += 1
-                                
-                        except requests.exceptions.Timeout:
-                            print(f"Timeout error downloading {video_url}. Attempt {retry_count + 1}/{max_retries}")
-                            retry_count += 1
-                        except requests.exceptions.RequestException as e:
-                            print(f"Network error downloading {video_url}: {e}. Attempt {retry_count + 1}/{max_retries}")
-                            retry_count += 1
-                        except Exception as e:
-                            print(f"Failed to download {video_url}: {e}. Attempt {retry_count + 1}/{max_retries}")
-                            retry_count += 1
+                    for post_data, redgif_url in batch:
+                        video_url = resolved.get(redgif_url)
+                        if not video_url:
+                            emit(POST_SKIPPED, "Failed to extract Redgif video URL", 'error', post_id=post_id(post_data),
+                                 reason='unresolved')
+                            continue
+                        
+                        index = base_index + count
+                        filename = download_gif_video(video_url, post_data, output_dir, index, session, max_bytes)
+                        if filename:
+                            if state:
+                                state.record(post_id(post_data), 'redgif', index, filename)
+                            count += 1
+                        
+                        # Check if we reached the download limit
+                        if count >= limit:
+                            log(f"Reached download limit of {limit}")
+                            break
                     
-                    # Check if we reached the download limit        
-                    if count >= limit:
-                        print(f"Reached download limit of {limit}")
-                        break
-              # Get the 'after' parameter for the next page
-            after = data.get('data', {}).get('after')
-            if not after:
-                print("No more pages available.")
-                break
+                    listing.set_remaining(limit - count)
+                
+                if count >= limit or reached_known:
+                    break
                 
         except Exception as e:
-            print(f"Error processing page: {e}")
-            break
-            
-    print(f"Total Redgif videos downloaded: {count}")
+            log(f"Error processing page: {e}", level='error')
+            failed = True
+    
+    run.finish(failed or listing.failed)
+    emit(SCRAPE_FINISHED, f"Total Redgif videos downloaded: {count}", subreddit=subreddit_name, media='gifs',
+         count=count)
+    return count
 
 if __name__ == "__main__":
     subreddit = input("Enter subreddit: ")
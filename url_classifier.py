@@ -0,0 +1,136 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+# Decides what a post's URL points at. Each URL is split once and handed to
+# the handler registered for its host (or a parent domain of it), which
+# knows how that host lays out its links; hosts without a handler are
+# treated as direct links and judged by their file extension. Query strings
+# and fragments never affect the result. A new host is one more handler here
+# rather than another branch in each scraper.
+
+IMAGE = 'image'
+VIDEO = 'video'
+REDGIF = 'redgif'
+
+IMAGE_EXTENSIONS = frozenset(('.jpg', '.jpeg', '.png', '.webp'))
+VIDEO_EXTENSIONS = frozenset(('.gif', '.mp4', '.webm'))
+
+# scheme://host[:port]path, up to the query or fragment. Cheaper than
+# urllib.parse.urlsplit, which was most of the routing time.
+URL = re.compile(r'https?://([^/?#:]+)(?::\d*)?([^?#]*)', re.IGNORECASE)
+# Redgifs pages: /watch/<id>, /ifr/<id> or /<id>
+REDGIFS_PAGE = re.compile(r'/(?:watch/|ifr/)?([^/]+)/?')
+# Files on the Redgifs CDN: /<id>.mp4, /<id>-mobile.mp4...
+REDGIFS_FILE = re.compile(r'/([^/.]+?)(?:-mobile|-silent)?\.\w+')
+# Redgifs links in a post's body
+REDGIFS_LINK = re.compile(r'https?://(?:www\.)?redgifs\.com/\S+')
+
+# kind is IMAGE, VIDEO or REDGIF; url is what to fetch (rewritten for hosts
+# like imgur's .gifv); handler names the handler that matched; media_id is
+# the host's id for the media, where there is one
+UrlMatch = namedtuple('UrlMatch', 'kind url handler media_id')
+
+# host -> (handler name, handler)
+HANDLERS = {}
+
+
+def register(name, *hosts):
+    # Decorator for handler(url, path) -> (kind, url, media_id) or None,
+    # called for URLs on `hosts` and their subdomains; path is the URL's
+    # path without the query
+    def decorator(handler):
+        for host in hosts:
+            HANDLERS[host.lower()] = (name, handler)
+        _handler.cache_clear()
+        classify_url.cache_clear()
+        return handler
+    return decorator
+
+
+def extension(path):
+    # '.jpg' for /a/b.JPG, '' when there is none (dotfiles included, as
+    # with os.path.splitext)
+    name = path.rpartition('/')[2]
+    dot = name.rfind('.')
+    return name[dot:].lower() if dot > 0 else ''
+
+
+def direct_link(url, path):
+    ext = extension(path)
+    if ext in IMAGE_EXTENSIONS:
+        return IMAGE, url, None
+    if ext in VIDEO_EXTENSIONS:
+        return VIDEO, url, None
+    return None
+
+
+@lru_cache(maxsize=1024)
+def _handler(host):
+    # The handler of the host or its closest registered parent domain; a
+    # listing only spans a handful of hosts
+    while host:
+        entry = HANDLERS.get(host)
+        if entry:
+            return entry
+        host = host.partition('.')[2]
+    return 'direct', direct_link
+
+
+@lru_cache(maxsize=8192)
+def classify_url(url):
+    # UrlMatch for an http(s) media URL, or None when it isn't one. Cached:
+    # the scrapers ask about the same post URL several times while routing it.
+    match = URL.match(url) if url else None
+    if not match:
+        return None
+    name, handler = _handler(match.group(1).lower())
+    result = handler(url, match.group(2))
+    return UrlMatch(result[0], result[1], name, result[2]) if result else None
+
+
+def find_redgifs_link(text):
+    # First Redgifs link in a block of text (a self post's body), or None
+    match = REDGIFS_LINK.search(text or '')
+    if not match:
+        return None
+    url = classify_url(match.group(0))
+    return url.url if url and url.kind == REDGIF else None
+
+
+@register('reddit', 'i.redd.it', 'preview.redd.it', 'external-preview.redd.it')
+def _reddit_media(url, path):
+    return direct_link(url, path)
+
+
+@register('reddit_video', 'v.redd.it')
+def _reddit_video(url, path):
+    # DASH renditions; the bare v.redd.it/<id> a video post links to is
+    # fetched from the post's media instead
+    result = direct_link(url, path)
+    return result if result and result[0] == VIDEO else None
+
+
+@register('imgur', 'imgur.com')
+def _imgur(url, path):
+    # .gifv is an HTML player page around the .mp4 of the same name; album
+    # and page links (no extension) aren't handled
+    if extension(path) == '.gifv':
+        # The host can't contain a '/', so the first occurrence is the path
+        return VIDEO, url.replace(path, path[:-len('.gifv')] + '.mp4', 1), None
+    return direct_link(url, path)
+
+
+@register('redgifs', 'redgifs.com')
+def _redgifs(url, path):
+    # Pages and CDN files alike go through the Redgifs API by id, which
+    # hands out playable (signed) URLs
+    match = REDGIFS_FILE.fullmatch(path) or REDGIFS_PAGE.fullmatch(path)
+    return (REDGIF, url, match.group(1)) if match else None
+
+
+@register('gifdeliverynetwork', 'gifdeliverynetwork.com')
+def _gifdeliverynetwork(url, path):
+    # Old Redgifs domain with the same ids
+    match = REDGIFS_PAGE.fullmatch(path)
+    return (REDGIF, url, match.group(1)) if match else None
@@ -0,0 +1,72 @@
+import re
+
+# Picks a smaller rendition of a post's media from what the listing already
+# describes, so scrapes that only need thumbnails don't pull full-size
+# originals. Nothing here makes a request.
+
+# Renditions v.redd.it encodes; DASH_<n>.mp4 exists for each one up to the
+# post's own
+DASH_HEIGHTS = (1080, 720, 480, 360, 240)
+DASH_RENDITION = re.compile(r'DASH_(\d+)\.mp4')
+
+
+def _fits(variant, max_width, max_height):
+    return ((not max_width or variant['width'] <= max_width)
+            and (not max_height or variant['height'] <= max_height))
+
+
+def rendition_key(max_width=None, max_height=None):
+    # Names a size bound for the dedup index ('512x', 'x480', '512x480'), or
+    # None for originals
+    if not (max_width or max_height):
+        return None
+    return f"{max_width or ''}x{max_height or ''}"
+
+
+def pick_image_variant(source, resolutions, max_width=None, max_height=None):
+    # source and resolutions are {'url', 'width', 'height'} dicts, as in a
+    # post's preview.images. Returns the URL of the largest resolution within
+    # the bounds (the smallest one when none is), or None when the source
+    # already fits and the original should be kept.
+    if not (max_width or max_height):
+        return None
+    variants = [variant for variant in resolutions if variant.get('url') and variant.get('width')
+                and variant.get('height')]
+    if not variants or (source.get('width') and source.get('height') and _fits(source, max_width, max_height)):
+        return None
+    fitting = [variant for variant in variants if _fits(variant, max_width, max_height)]
+    if fitting:
+        best = max(fitting, key=lambda variant: variant['width'] * variant['height'])
+    else:
+        best = min(variants, key=lambda variant: variant['width'])
+    return best['url'].replace('&amp;', '&')
+
+
+def preview_variant(post_data, max_width=None, max_height=None):
+    # Downscaled copy of a post's image from its preview, or None
+    images = (post_data.get('preview') or {}).get('images') or []
+    if not images:
+        return None
+    return pick_image_variant(images[0].get('source') or {}, images[0].get('resolutions') or [], max_width,
+                              max_height)
+
+
+def gallery_variant(media, max_width=None, max_height=None):
+    # Same for a gallery item's media_metadata entry, whose source is `s` and
+    # resolutions `p`, with x / y / u for width / height / url
+    def variant(entry):
+        return {'url': entry.get('u'), 'width': entry.get('x'), 'height': entry.get('y')}
+    return pick_image_variant(variant(media.get('s') or {}), [variant(entry) for entry in media.get('p') or []],
+                              max_width, max_height)
+
+
+def pick_video_variant(video_url, max_height=None):
+    # A v.redd.it fallback URL rewritten to the tallest rendition no taller
+    # than max_height (480 for 480p), or None to keep it. Renditions are named
+    # after the short side, so this also caps vertical videos sensibly.
+    # Older posts with bitrate-named files (DASH_2_4_M) are left alone.
+    match = DASH_RENDITION.search(video_url or '')
+    if not max_height or not match or int(match.group(1)) <= max_height:
+        return None
+    height = next((height for height in DASH_HEIGHTS if height <= max_height), DASH_HEIGHTS[-1])
+    return f"{video_url[:match.start(1)]}{height}{video_url[match.end(1):]}"